@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+
+"""
+DESCRIPTION: Per-student, per-section and per-assignment summaries of the student assignment
+    activity: late/missing/excused counts, on-time rates, score distributions and submission
+    lead time quantiles, computed with grouped pandas operations (no Python loops over rows).
+INPUT(S):
+    - The tables from transform.course_frames or transform.normalized_frames
+"""
+
+import re
+
+# quantiles reported for scores and submission lead times
+quantiles = [0.1, 0.25, 0.5, 0.75, 0.9]
+# summary table name -> the activity columns it is grouped by
+summary_keys = {
+    'student_summary': ['studentId'],
+    'section_summary': ['sectionId'],
+    'assignment_summary': ['assignmentId'],
+}
+# the columns of every summary table after its key and labels (see summarize)
+summary_columns = ['rows', 'submitted', 'on_time', 'late', 'missing', 'excused', 'submissions', 'score_mean',
+                   'score_std', 'percentage_mean', 'lead_hours_mean', 'on_time_rate', 'late_rate', 'missing_rate'] + \
+    ['%s_p%d' % (prefix, round(q * 100)) for prefix in ('score', 'lead_hours') for q in quantiles]
+# summary table name -> its key and label columns
+summary_labels = {
+    'student_summary': ['studentId', 'sortableName'],
+    'section_summary': ['sectionId', 'sectionName', 'students'],
+    'assignment_summary': ['assignmentId', 'assignmentName', 'dueDate'],
+}
+# the format of the formatted datetime columns (see transform.reformat)
+datetime_format = '%Y-%m-%d %H:%M:%S'
+
+
+def with_columns(frame, names):
+    """the frame, with any of the named columns it lacks added as empty ones (e.g., no submissions at all)"""
+    missing = [name for name in names if name not in frame]
+    return frame.reindex(columns=list(frame.columns) + missing) if missing else frame
+
+
+def flag(frame, name):
+    """a boolean column, False where the flag is missing"""
+    return frame[name].eq(True) if name in frame else False
+
+
+def activity_table(frames):
+    """one row per student per assignment with the submission, flags and lead time as plain columns
+        The submission is the first in each row's submissions list (the current one).
+        Args:
+            frames: The course tables, flat or normalized.
+        Returns:
+            A DataFrame with studentId, assignmentId, assignmentName, due,
+            submitted_at, submissions, score, percentage, late, missing, excused,
+            submitted, on_time and lead_hours (hours between submission and due date).
+    """
+    import pandas as pd
+    source = frames['student_assignment_activity']
+    activity = source[['studentId', 'assignmentId', 'assignmentName']].copy()
+    activity['due'] = pd.to_datetime(source['dueDate'], format=datetime_format, errors='coerce')
+    if 'submissions' in frames:  # normalized: a long submissions table
+        submissions = with_columns(frames['submissions'],
+                                   ['assignmentId', 'studentId', 'position', 'date', 'scoreRaw', 'percentage'])
+        keys = ['assignmentId', 'studentId']
+        current = submissions[submissions['position'] == 0].set_index(keys)
+        counts = submissions.groupby(keys).size()
+        index = pd.MultiIndex.from_frame(source[keys])
+        activity['submitted_at'] = pd.to_datetime(current['date'].reindex(index).to_numpy(),
+                                                  format=datetime_format, errors='coerce')
+        activity['submissions'] = counts.reindex(index).fillna(0).astype('int64').to_numpy()
+        activity['score'] = pd.to_numeric(current['scoreRaw'].reindex(index), errors='coerce').to_numpy()
+        activity['percentage'] = pd.to_numeric(current['percentage'].reindex(index), errors='coerce').to_numpy()
+    else:  # flat: numbered submissions.N.* columns
+        dates = [name for name in source.columns if re.fullmatch(r'submissions\.\d+\.date', name)]
+        activity['submitted_at'] = pd.to_datetime(source.get('submissions.0.date'), format=datetime_format,
+                                                  errors='coerce') if dates else pd.NaT
+        activity['submissions'] = source[dates].notna().sum(axis=1) if dates else 0
+        for column, name in (('score', 'submissions.0.scoreRaw'), ('percentage', 'submissions.0.percentage')):
+            activity[column] = pd.to_numeric(source[name], errors='coerce') if name in source else float('nan')
+    for name in ('late', 'missing', 'excused'):
+        activity[name] = flag(source, name)
+    activity['submitted'] = activity['submitted_at'].notna()
+    activity['on_time'] = activity['submitted'] & ~activity['late']
+    activity['lead_hours'] = (activity['due'] - activity['submitted_at']).dt.total_seconds() / 3600
+    return activity
+
+
+def student_sections(frames):
+    """the section(s) of every student, as studentId, sectionId and sectionName"""
+    import pandas as pd
+    if 'student_sections' in frames:  # normalized
+        sections = with_columns(frames['student_sections'], ['studentId', 'id', 'name'])
+        return pd.DataFrame({'studentId': sections['studentId'], 'sectionId': sections['id'],
+                             'sectionName': sections['name']})
+    students = frames['students']
+    positions = sorted({int(m.group(1)) for m in map(re.compile(r'sections\.(\d+)\.id$').match, students.columns) if m})
+    sections = pd.concat([pd.DataFrame({'studentId': students['student.id'],
+                                        'sectionId': students['sections.%d.id' % i],
+                                        'sectionName': students.get('sections.%d.name' % i)})
+                          for i in positions], ignore_index=True) if positions else \
+        pd.DataFrame(columns=['studentId', 'sectionId', 'sectionName'])
+    return sections[sections['sectionId'].notna()]
+
+
+def summarize(activity, keys):
+    """counts, rates and quantiles of the activity grouped by keys"""
+    grouped = activity.groupby(keys, sort=True)
+    summary = grouped.agg(
+        rows=('assignmentId', 'size'), submitted=('submitted', 'sum'), on_time=('on_time', 'sum'),
+        late=('late', 'sum'), missing=('missing', 'sum'), excused=('excused', 'sum'),
+        submissions=('submissions', 'sum'), score_mean=('score', 'mean'), score_std=('score', 'std'),
+        percentage_mean=('percentage', 'mean'), lead_hours_mean=('lead_hours', 'mean'))
+    summary['on_time_rate'] = summary['on_time'] / summary['rows']
+    summary['late_rate'] = summary['late'] / summary['rows']
+    summary['missing_rate'] = summary['missing'] / summary['rows']
+    for column, prefix in (('score', 'score'), ('lead_hours', 'lead_hours')):
+        q = grouped[column].quantile(quantiles).unstack()
+        q.columns = ['%s_p%d' % (prefix, round(x * 100)) for x in q.columns]
+        summary = summary.join(q)
+    return summary.reset_index().reindex(columns=keys + summary_columns)  # all columns, even with no groups
+
+
+def summary_frames(frames):
+    """build the student, section and assignment summaries of a course
+        Args:
+            frames: The course tables (see transform.course_frames and transform.normalized_frames).
+        Returns:
+            A dict of summary table name (see summary_keys) to DataFrame; the
+            tables are empty when the course has no activity rows.
+    """
+    import pandas as pd
+    if frames['student_assignment_activity'].empty:  # no students or no assignments
+        return {table: pd.DataFrame(columns=labels + summary_columns) for table, labels in summary_labels.items()}
+    activity = activity_table(frames)
+    sections = student_sections(frames)
+    summaries = {
+        'student_summary': summarize(activity, summary_keys['student_summary']),
+        # a student in several sections counts towards each of them
+        'section_summary': summarize(activity.merge(sections[['studentId', 'sectionId']], on='studentId'),
+                                     summary_keys['section_summary']),
+        'assignment_summary': summarize(activity, summary_keys['assignment_summary']),
+    }
+    # labels
+    students = frames['students'][['student.id', 'student.studentInfo.sortableName']].rename(
+        columns={'student.id': 'studentId', 'student.studentInfo.sortableName': 'sortableName'})
+    summaries['student_summary'] = students.merge(summaries['student_summary'], on='studentId', how='right')
+    summaries['section_summary'].insert(1, 'sectionName', summaries['section_summary']['sectionId'].map(
+        sections.drop_duplicates('sectionId').set_index('sectionId')['sectionName']))
+    summaries['section_summary'].insert(2, 'students', summaries['section_summary']['sectionId'].map(
+        sections.groupby('sectionId')['studentId'].nunique()))
+    assignments = activity.drop_duplicates('assignmentId').set_index('assignmentId')
+    summaries['assignment_summary'].insert(1, 'assignmentName', summaries['assignment_summary']['assignmentId'].map(
+        assignments['assignmentName']))
+    summaries['assignment_summary'].insert(2, 'dueDate', summaries['assignment_summary']['assignmentId'].map(
+        assignments['due']))
+    return summaries
@@ -4,15 +4,20 @@
 DESCRIPTION: This script scrapes the Canvas student gradebook for specific entries.
 INPUT(S):
     - A class roster CSV file generated using Canvas | New Analytics | Reports | Roster.
+    - An analytics session, either from the scraper.py session cache or given explicitly.
 """
 
 import sys
 import os
+import csv
+import random
 import logging
-import requests
-import pandas as pd
+import argparse
+import asyncio
 import json
 import time
+import aiohttp
+import pandas as pd
 
 # configure logging
 logging.basicConfig(
@@ -28,21 +33,10 @@ logger = logging.getLogger('jaisohn')
 #    Student Name,Student ID,Student SIS ID,Email,Section Name
 #    John Doe,203324,906350663,johndoe@vt.edu,ME_2004_90433_202209
 #    ...
-# path to the roster file
-roster_path = './roster.csv'
 # canvas add this prefix to the student id provided in the roster list. maybe associated with course?
 roster_prefix = '45110000000'
 
-# request parameters
-session_id = 'a7fc6d46-a909-4577-bdd8-00a94f299972'
-context_id = '7c82cf32d76cd2933b7516aa68c2b8686d6754af'
-tc_guid = 'yDz0MxxBs02YM08vCb8fQ85ISbDXw62vLT6KiA6s:canvas-lms'
-
-# assignment name
-assignment_name = 'HW 1 Work'
-
 # POST GraphQL query string
-# this is a terrible way to do this
 graphql_url = 'https://canvas-analytics-iad-prod.inscloudgate.net/v2/graphql'
 graphql_headers = {
     'authority': 'canvas-analytics-iad-prod.inscloudgate.net',
@@ -57,37 +51,177 @@ graphql_headers = {
     'sec-fetch-des': 'empty',
     'sec-fetch-mode': 'cors',
     'sec-fetch-site': 'same-origin',
-    'session-id': '%s'%session_id,
     'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/105.0.0.0 Safari/537.36',
     'x-graphql-deduplicate': 'true'
 }
-graphql_payload_template = '{"operationName":"StudentCourseGradeQuery","variables":{"contextId":"%s",'%context_id + '"tcGuid":"%s",'%tc_guid + '"studentId":"%s'%roster_prefix + 'STUDENT_ID"},"query":"query StudentCourseGradeQuery($contextId: String\u0021, $tcGuid: String\u0021, $studentId: ID\u0021) {course(contextId: $contextId, tcGuid: $tcGuid) {assignmentForCourseConnection {  edges {    assignment {      id      assignmentType      __typename    }    __typename  }  __typename}assignmentsForStudent(id: $studentId) {  assignmentId  assignmentName  studentId  dueDate  submissions {    scoreRaw    percentage    date    __typename  }  excused  missing  late  __typename}studentInCourse(id: $studentId) {  currentOverallScore  sections {    id    name    __typename  }  student {    id    studentInfo {      name      sortableName      shortName      lastLoggedOut      avatarURL      __typename    }    __typename  }  __typename}__typename}}"}'
+student_course_grade_query = 'query StudentCourseGradeQuery($contextId: String!, $tcGuid: String!, $studentId: ID!) {course(contextId: $contextId, tcGuid: $tcGuid) {assignmentForCourseConnection {  edges {    assignment {      id      assignmentType      __typename    }    __typename  }  __typename}assignmentsForStudent(id: $studentId) {  assignmentId  assignmentName  studentId  dueDate  submissions {    scoreRaw    percentage    date    __typename  }  excused  missing  late  __typename}studentInCourse(id: $studentId) {  currentOverallScore  sections {    id    name    __typename  }  student {    id    studentInfo {      name      sortableName      shortName      lastLoggedOut      avatarURL      __typename    }    __typename  }  __typename}__typename}}'
+
+# responses worth retrying
+retry_statuses = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """token-bucket rate limiter shared by all requests"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """wait until a request may be sent"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class QueryFailed(Exception):
+    """a student query failed after all retries"""
+
+
+def load_session(args):
+    """build the GraphQL URL, headers and variables from the command line or the scraper.py session cache"""
+    if args.session_cache:
+        with open(args.session_cache) as f:
+            courses = json.load(f).get('courses', {})
+        if args.course_url not in courses:
+            sys.exit(f'No cached analytics session for {args.course_url} in {args.session_cache}.')
+        analytics_session = courses[args.course_url]
+        return analytics_session['graphql_url'], analytics_session['headers'], \
+            analytics_session['context_id'], analytics_session['tc_guid']
+    if not (args.session_id and args.context_id and args.tc_guid):
+        sys.exit('Either --session-cache and --course-url, or --session-id, --context-id and --tc-guid are required.')
+    return args.graphql_url, dict(graphql_headers, **{'session-id': args.session_id}), args.context_id, args.tc_guid
+
+
+async def query_student(http, bucket, semaphore, url, headers, variables, retries):
+    """run StudentCourseGradeQuery for one student, retrying 429/5xx and network errors with backoff"""
+    payload = {'operationName': 'StudentCourseGradeQuery', 'variables': variables,
+               'query': student_course_grade_query}
+    async with semaphore:
+        for attempt in range(retries + 1):
+            await bucket.acquire()
+            delay = min(30, 0.5 * 2 ** attempt) * (0.5 + random.random())
+            try:
+                async with http.post(url, headers=headers, json=payload) as response:
+                    if response.status in retry_statuses:
+                        error = f'HTTP {response.status}'
+                        retry_after = response.headers.get('Retry-After')
+                        if retry_after and retry_after.isdigit():
+                            delay = max(delay, int(retry_after))
+                    else:
+                        response.raise_for_status()
+                        data = await response.json(content_type=None)
+                        if data.get('errors'):
+                            raise QueryFailed(data['errors'])
+                        course = (data.get('data') or {}).get('course')
+                        if course is None:
+                            raise QueryFailed('no course in the response')
+                        if course.get('studentInCourse') is None:  # e.g., dropped, or a typo in the roster
+                            raise QueryFailed('student not in the course')
+                        if not isinstance(course.get('assignmentsForStudent', ''), (list, type(None))):
+                            raise QueryFailed('no assignmentsForStudent in the response')
+                        return course
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if isinstance(e, aiohttp.ClientResponseError) and e.status not in retry_statuses:
+                    raise QueryFailed(f'HTTP {e.status}')
+                error = repr(e)
+            if attempt < retries:
+                await asyncio.sleep(delay)
+        raise QueryFailed(f'{error} after {retries + 1} attempts')
+
+
+def submission_date(course, assignment_name):
+    """the date of the student's first submission of the assignment, or '' if there is none"""
+    date = ''
+    for assignment in course['assignmentsForStudent'] or []:
+        if assignment['assignmentName'] == assignment_name and assignment['submissions'] \
+                and assignment['submissions'][0]['date'] is not None:
+            date = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(assignment['submissions'][0]['date']/1000.0))
+    return date
+
+
+async def scrape(args, roster, out, failures):
+    """query every student on the roster and stream their submission dates as they arrive"""
+    url, headers, context_id, tc_guid = load_session(args)
+    bucket = TokenBucket(args.rate, args.burst)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+
+        async def run(idx):
+            variables = {'contextId': context_id, 'tcGuid': tc_guid,
+                         'studentId': roster_prefix + str(roster['Student ID'][idx])}
+            try:
+                course = await query_student(http, bucket, semaphore, url, headers, variables, args.retries)
+                return idx, submission_date(course, args.assignment), None
+            except (QueryFailed, KeyError, TypeError, ValueError) as e:
+                return idx, None, e
+
+        tasks = [asyncio.ensure_future(run(idx)) for idx in roster.index]
+        failed = 0
+        for task in asyncio.as_completed(tasks):
+            idx, date, error = await task
+            name = roster['Student Name'][idx]
+            if error is not None:
+                failed += 1
+                logger.error('Query for %s (%s) failed: %s' % (name, roster['Student ID'][idx], error))
+                failures.writerow([roster['Student ID'][idx], name, str(error)])
+                continue
+            out.writerow([name, args.assignment, date])
+        return failed
+
 
 def main():
     """ the main function """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--roster', default='./roster.csv', help='path to the roster file')
+    parser.add_argument('--assignment', default='HW 1 Work', help='assignment name')
+    parser.add_argument('--session-cache', help='scraper.py session cache to take the analytics session from')
+    parser.add_argument('--course-url', help='course URL of the cached analytics session')
+    parser.add_argument('--graphql-url', default=graphql_url, help='analytics GraphQL endpoint')
+    parser.add_argument('--session-id', help='analytics session-id header')
+    parser.add_argument('--context-id', help='analytics contextId')
+    parser.add_argument('--tc-guid', help='analytics tcGuid')
+    parser.add_argument('--concurrency', type=int, default=16, help='maximum requests in flight')
+    parser.add_argument('--rate', type=float, default=20, help='maximum requests per second')
+    parser.add_argument('--burst', type=int, default=20, help='requests allowed in a burst above the rate')
+    parser.add_argument('--retries', type=int, default=5, help='retries for 429/5xx and network errors')
+    parser.add_argument('--timeout', type=float, default=60, help='per-request timeout in seconds')
+    parser.add_argument('--output', help='CSV output file (default: stdout)')
+    parser.add_argument('--failures', default='failures.csv', help='CSV file listing students whose query failed')
+    args = parser.parse_args()
+
+    # does roster file exist?
+    if not os.path.exists(args.roster):
+        sys.exit(f'Roster file ({args.roster}) not found.')
+
+    # open and process the roster file
+    roster = pd.read_csv(args.roster)
+    # make sure required columns exists
+    if not 'Student Name' in roster.columns or not 'Student ID' in roster.columns:
+        sys.exit(f'Roster file ({args.roster}) format is invalid.')
+
+    out_file = open(args.output, 'w', newline='') if args.output else sys.stdout
+    with open(args.failures, 'w', newline='') as failures_file:
+        out = csv.writer(out_file)
+        failures = csv.writer(failures_file)
+        failures.writerow(['Student ID', 'Student Name', 'Error'])
+        failed = asyncio.run(scrape(args, roster, out, failures))
+    if out_file is not sys.stdout:
+        out_file.close()
+    if failed:
+        sys.exit(f'{failed} of {len(roster.index)} student queries failed; see {args.failures}.')
 
 
-# does roster file exist?
-if not os.path.exists(roster_path):
-    sys.exit(f'Roster file ({roster_path}) not found.')
-
-# open and process the roster file
-roster = pd.read_csv(roster_path)
-# make sure required columns exists
-if not 'Student Name' in roster.columns or not 'Student ID' in roster.columns:
-    sys.exit(f'Roster file ({roster_path}) format is invalid.')
-# build 
-for idx in roster.index:
-    graphql_json_payload = json.loads(graphql_payload_template.replace('STUDENT_ID', str(roster['Student ID'][idx])))
-    response = requests.post(graphql_url, headers=graphql_headers, json=graphql_json_payload)
-    data = response.json()
-    try:
-        assignments = data['data']['course']['assignmentsForStudent']
-        for assignment in assignments:
-            if assignment['assignmentName'] == assignment_name:
-                if assignment['submissions'][0]['date'] != None:
-                    print(roster['Student Name'][idx] + ',' + assignment_name + ',' + time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(assignment['submissions'][0]['date']/1000.0)))
-    except:
-        pass
 if __name__ == '__main__':
     main()
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+
+"""
+DESCRIPTION: This script benchmarks the compiled flattener against the original recursive
+    flatten_json/reformat, and checks that both produce identical tables.
+INPUT(S):
+    - Synthetic course size (students, assignments, sections)
+"""
+
+import os
+import sys
+import re
+import time
+import argparse
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from transform import Flattener  # noqa: E402
+from synthetic import synthetic_course  # noqa: E402
+
+#
+# the original implementation, kept as the reference
+#
+exclude = ['__typename', 'missing', 'avatarURL', 'cursor']
+datetime_headers = ['lastParticipationTime', 'lastPageviewTime', 'lastLoggedOut', 'dueDate', '.date']
+def reformat(name, x):
+    """apply any special value re-formatting"""
+
+    # change datetime fields to Y-m-d H:M:S
+    if re.search(r'|'.join(datetime_headers), name) and isinstance(x, int):
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(x/1000.0))
+
+    return x
+
+def flatten_json(nested_json, exclude=['']):
+    """Flatten json object with nested keys into a single level."""
+    out = {}
+
+    # recursively flatten JSON
+    def flatten(x, name='', exclude=exclude):
+        if type(x) is dict:
+            for a in x:
+                if a not in exclude:
+                    flatten(x[a], name + a + '.')
+        elif type(x) is list:
+            i = 0
+            for a in x:
+                flatten(a, name + str(i) + '.')
+                i += 1
+        else:
+            out[name[:-1]] = reformat(name[:-1], x)
+
+    flatten(nested_json)
+    return out
+
+
+def reference_frames(json_response):
+    """the tables as the original scraper built them"""
+    course = json_response['data']['course']
+    return {
+        'students': pd.DataFrame([flatten_json(
+            x, exclude) for x in course['studentInCourseConnection']['edges']]),
+        'assignments': pd.DataFrame([flatten_json(
+            x, exclude) for x in course['assignmentForCourseConnection']['edges']]),
+        'student_assignment_activity': pd.DataFrame([flatten_json(
+            x, exclude) for x in course['assignmentsForStudents']]),
+    }
+
+
+def compiled_frames(json_response):
+    """the same tables from the compiled flattener"""
+    course = json_response['data']['course']
+    return {
+        'students': pd.DataFrame(Flattener(exclude).flatten_rows(
+            course['studentInCourseConnection']['edges'])),
+        'assignments': pd.DataFrame(Flattener(exclude).flatten_rows(
+            course['assignmentForCourseConnection']['edges'])),
+        'student_assignment_activity': pd.DataFrame(Flattener(exclude).flatten_rows(
+            course['assignmentsForStudents'])),
+    }
+
+
+def best_of(repeat, f, *args):
+    """best wall time of several runs, and the last result"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    """ the main function """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--students', type=int, default=300)
+    parser.add_argument('--assignments', type=int, default=40)
+    parser.add_argument('--sections', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    json_response = synthetic_course(args.students, args.assignments, args.sections)
+    print('%d students, %d assignments, %d activity rows' % (
+        args.students, args.assignments, args.students * args.assignments))
+    reference_time, expected = best_of(args.repeat, reference_frames, json_response)
+    compiled_time, actual = best_of(args.repeat, compiled_frames, json_response)
+    for name in expected:
+        if expected[name].to_csv() != actual[name].to_csv():
+            sys.exit('%s differs from the reference output' % name)
+    print('reference: %.3f s' % reference_time)
+    print('compiled:  %.3f s (%.1fx)' % (compiled_time, reference_time / compiled_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+
+"""
+DESCRIPTION: This script reports how much memory the course tables take, as built by default and
+    in compact mode (int64 IDs, categorical names, bool flags, datetime64 dates), for synthetic
+    courses of several sizes: the tables' own size, the time to build them, and how much the
+    process's resident memory grows while it holds them. Each course size and mode runs in its
+    own process so that memory is not shared.
+INPUT(S):
+    - Course sizes as STUDENTSxASSIGNMENTS[xSECTIONS]
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+from transform import course_frames, normalized_frames, frames_memory  # noqa: E402
+from synthetic import synthetic_course  # noqa: E402
+
+
+def rss_mb():
+    """current resident set size of this process, in MiB (Linux)"""
+    gc.collect()
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+def run_mode(size, compact, normalize, courses):
+    """build the tables of several courses of one size and hold them all"""
+    n_students, n_assignments, n_sections = (list(map(int, size.lower().split('x'))) + [8])[:3]
+    bodies = [json.dumps(synthetic_course(n_students, n_assignments, n_sections, seed=i)).encode()
+              for i in range(courses)]
+    # the responses are freed as they are decoded, so count them back in
+    body_mb = sum(len(body) for body in bodies) / 2**20
+    baseline = rss_mb()
+    held = []
+    start = time.perf_counter()
+    while bodies:
+        json_response = json.loads(bodies.pop())
+        held.append((normalized_frames if normalize else course_frames)(json_response, compact))
+        del json_response
+    seconds = time.perf_counter() - start
+    memory = {}
+    for frames in held:
+        for table, size_bytes in frames_memory(frames).items():
+            memory[table] = memory.get(table, 0) + size_bytes
+    return {'seconds': seconds, 'tables_mb': {table: b / 2**20 for table, b in memory.items()},
+            'held_rss_mb': rss_mb() - baseline + body_mb}
+
+
+def main():
+    """ the main function """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='100x20,1000x50,10000x20,1000x500',
+                        help='comma separated course sizes as STUDENTSxASSIGNMENTS[xSECTIONS]')
+    parser.add_argument('--courses', type=int, default=1, help='courses of each size held at once')
+    parser.add_argument('--normalize', action='store_true', help='build the normalized tables')
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    parser.add_argument('--child', nargs=2, metavar=('SIZE', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:  # one size and mode, in a fresh process
+        size, mode = args.child
+        print(json.dumps(run_mode(size, mode == 'compact', args.normalize, args.courses)))
+        return
+
+    results = []
+    print('%-12s %-8s %10s %14s %14s  %s' % ('size', 'mode', 'seconds', 'tables MiB', 'held RSS MiB', 'per table MiB'))
+    for size in args.sizes.split(','):
+        for mode in ('default', 'compact'):
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', size, mode,
+                                  '--courses', str(args.courses)] + (['--normalize'] if args.normalize else []),
+                                 check=True, capture_output=True, text=True).stdout
+            result = dict(json.loads(out), size=size, mode=mode)
+            results.append(result)
+            print('%-12s %-8s %10.3f %14.1f %14.1f  %s' % (
+                size, mode, result['seconds'], sum(result['tables_mb'].values()), result['held_rss_mb'],
+                ', '.join('%s %.1f' % item for item in result['tables_mb'].items())))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+
+"""
+DESCRIPTION: This script benchmarks the scraping pipeline stage by stage against the local mock
+    Canvas server (mock_canvas.py), reporting wall time and peak RSS for the capture (HTTP
+    replay of CourseDetail), decode, flatten_json, DataFrame build, analytics and CSV write stages.
+    Each course size runs in its own process so that peak RSS is not shared between sizes.
+INPUT(S):
+    - Course sizes as STUDENTSxASSIGNMENTS[xSECTIONS]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+import importlib
+import requests
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+from transform import course_rows, rows_frames  # noqa: E402
+from metrics import peak_rss_bytes  # noqa: E402
+from analytics import summary_frames  # noqa: E402
+from synthetic import context_id  # noqa: E402
+from mock_canvas import course_detail_query  # noqa: E402
+
+# the fixed session-id the benchmark's mock server accepts
+bench_session_id = 'bench'
+
+
+def peak_rss_mb():
+    """peak resident set size of this process so far, in MiB, or None where it cannot be measured (Windows)"""
+    peak = peak_rss_bytes()
+    return peak / 2**20 if peak is not None else None
+
+
+def run_stages(base_url, course_id):
+    """run every stage once for one course and return their timings"""
+    stages = []
+    importlib.import_module('pandas')  # imported lazily by transform; keep it out of the dataframe stage
+
+    def stage(name, f, *args):
+        start = time.perf_counter()
+        result = f(*args)
+        stages.append({'stage': name, 'seconds': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb()})
+        return result
+
+    def capture():
+        response = requests.post(base_url + '/v2/graphql', headers={'session-id': bench_session_id}, json={
+            'operationName': 'CourseDetail', 'query': course_detail_query,
+            'variables': {'contextId': context_id(course_id), 'tcGuid': 'synthetic:canvas-lms'}})
+        response.raise_for_status()
+        return response.content
+
+    def write_csv(frames):
+        with tempfile.TemporaryDirectory() as out_dir:
+            for table, frame in frames.items():
+                frame.to_csv(os.path.join(out_dir, table + '.csv'))
+
+    body = stage('capture', capture)
+    json_response = stage('decode', json.loads, body)
+    del body
+    rows = stage('flatten_json', course_rows, json_response)
+    del json_response
+    frames = stage('dataframe', rows_frames, rows)
+    rows_count = {table: len(r) for table, r in rows.items()}
+    del rows
+    stage('analytics', summary_frames, frames)
+    stage('to_csv', write_csv, frames)
+    return {'rows': rows_count, 'stages': stages}
+
+
+def free_port():
+    """an unused local TCP port"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout):
+    """wait for the mock server to accept connections"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError('mock Canvas server did not start')
+
+
+def main():
+    """ the main function """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='100x20,1000x50,10000x20,1000x500',
+                        help='comma separated course sizes as STUDENTSxASSIGNMENTS[xSECTIONS]')
+    parser.add_argument('--url', help='use an already running mock server (started with --session-id bench '
+                                      'and --course 1:SIZE --course 2:SIZE ... in --sizes order)')
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    parser.add_argument('--child', nargs=2, metavar=('URL', 'COURSE_ID'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:  # one size, in a fresh process
+        print(json.dumps(run_stages(*args.child)))
+        return
+
+    sizes = args.sizes.split(',')
+    server = None
+    base_url = args.url
+    if base_url is None:
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(here, 'mock_canvas.py'), '--port', str(port), '--preload',
+             '--session-id', bench_session_id] +
+            ['--course=%d:%s' % (i + 1, size) for i, size in enumerate(sizes)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        base_url = 'http://127.0.0.1:%d' % port
+    try:
+        if server is not None:
+            wait_for_port(port, timeout=600)
+        results = []
+        print('%-14s %10s  %-14s %10s %14s' % ('size', 'rows', 'stage', 'seconds', 'peak RSS MiB'))
+        for i, size in enumerate(sizes):
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', base_url, str(i + 1)],
+                                 check=True, capture_output=True, text=True).stdout
+            result = dict(json.loads(out), size=size)
+            results.append(result)
+            for s in result['stages']:
+                print('%-14s %10d  %-14s %10.3f %14s' % (
+                    size, result['rows']['student_assignment_activity'], s['stage'], s['seconds'],
+                    '%.1f' % s['peak_rss_mb'] if s['peak_rss_mb'] is not None else 'n/a'))
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/python3
+
+"""
+DESCRIPTION: This script runs a local stand-in for Canvas and the New Analytics GraphQL endpoint,
+    so scraper.py can be exercised and benchmarked without a live account or a Duo phone.
+    It serves:
+    - /courses/<id>: a login form (username, password, _eventId_proceed) until logged in,
+      then a course page with a New Analytics link
+    - /login: the 2FA page with a duo_iframe whose Send Me a Push button logs the browser in
+    - /courses/<id>/analytics: a page that POSTs CourseDetail to /v2/graphql
+    - /v2/graphql: CourseDetail (paged with first/after on assignmentsForStudents when asked),
+      CourseDetailPage, CourseWatermark and StudentCourseGradeQuery for synthetic courses
+INPUT(S):
+    - Port and the synthetic course sizes
+"""
+
+import re
+import sys
+import json
+import time
+import uuid
+import logging
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+from synthetic import synthetic_course, student_course_grade, context_id
+
+logger = logging.getLogger('mock_canvas')
+
+login_page = """<html><body>
+<form method="post" action="/login">
+<input type="hidden" name="next" value="%(next)s">
+<input id="username" name="username"> <input id="password" name="password" type="password">
+<button name="_eventId_proceed" type="submit">Log In</button>
+</form></body></html>"""
+
+duo_page = """<html><body><iframe id="duo_iframe" src="/duo?next=%(next)s"></iframe></body></html>"""
+
+duo_frame = """<html><body>
+<button onclick="fetch('/duo/push', {method: 'POST'}).then(function () {
+    setTimeout(function () { window.top.location = '%(next)s'; }, %(delay)d);
+})">Send Me a Push</button></body></html>"""
+
+course_page = """<html><body><h1>%(name)s</h1>
+<ul><li><a href="/courses/%(id)s/analytics">New Analytics</a></li></ul></body></html>"""
+
+analytics_page = """<html><body><div id="app">Loading...</div>
+<script>
+fetch('/v2/graphql', {
+    method: 'POST',
+    headers: {'content-type': 'application/json', 'session-id': '%(session_id)s'},
+    body: JSON.stringify({operationName: 'CourseDetail',
+                          variables: {contextId: '%(context_id)s', tcGuid: 'synthetic:canvas-lms'},
+                          query: %(query)s})
+}).then(function (r) { return r.json(); }).then(function (d) {
+    document.getElementById('app').textContent = d.data.course.name;
+});
+</script></body></html>"""
+
+course_detail_query = 'query CourseDetail($contextId: String!, $tcGuid: String!) { course(contextId: $contextId, tcGuid: $tcGuid) { contextId tcGuid courseId name startDate etlStart updatedAt mean sections { id name hasStudents __typename } assignmentForCourseConnection { edges { assignment { id name stats { min mean max missing late __typename } sectionStats { sectionId stats { min mean max missing late __typename } __typename } dueDate maxScoreRaw gradingType assignmentType sectionOverrides __typename } __typename } __typename } assignmentsForStudents { assignmentId assignmentName studentId cursor dueDate excused late missing submissions { date gradeRaw scoreRaw percentage __typename } __typename } studentInCourseConnection { edges { currentOverallScore lastParticipationTime lastPageviewTime sections { id name __typename } student { id studentId studentInfo { onTimePercentage name shortName sortableName lastLoggedOut avatarURL email sisId __typename } __typename } __typename } __typename } __typename } }'
+
+
+class MockCanvas:
+    """the synthetic courses and the login/analytics session state"""
+
+    def __init__(self, sizes, session_ttl, duo_delay, fixed_session_id=None):
+        self.sizes = sizes  # course id -> (students, assignments, sections)
+        self.session_ttl = session_ttl
+        self.duo_delay = duo_delay
+        self.fixed_session_id = fixed_session_id
+        self.courses = {}  # contextId -> (decoded response, serialized CourseDetail)
+        self.cursors = {}  # contextId -> {assignmentsForStudents cursor: row position}
+        self.logins = set()  # canvas_session cookies
+        self.sessions = {}  # analytics session-id -> expiry
+        self.lock = threading.Lock()
+
+    def course(self, course_id):
+        """generate (once) and return a course's decoded and serialized CourseDetail response"""
+        key = context_id(course_id)
+        with self.lock:
+            if key not in self.courses:
+                n_students, n_assignments, n_sections = self.sizes.get(course_id, self.sizes['*'])
+                json_response = synthetic_course(n_students, n_assignments, n_sections,
+                                                 seed=int(course_id), course_id=course_id)
+                self.courses[key] = (json_response, json.dumps(json_response).encode())
+            return self.courses[key]
+
+    def course_by_context(self, key):
+        """look up a course by its analytics contextId"""
+        with self.lock:
+            return self.courses.get(key)
+
+    def page(self, key, first, after=None):
+        """one page of a course's assignmentsForStudents, starting after the given cursor"""
+        json_response, _ = self.course_by_context(key)
+        rows = json_response['data']['course']['assignmentsForStudents']
+        with self.lock:
+            if key not in self.cursors:
+                self.cursors[key] = {row['cursor']: i for i, row in enumerate(rows)}
+            start = self.cursors[key][after] + 1 if after else 0
+        return rows[start:start + first]
+
+    def new_session(self):
+        """mint an analytics session-id"""
+        session_id = str(uuid.uuid4())
+        with self.lock:
+            self.sessions[session_id] = time.time() + self.session_ttl
+        return session_id
+
+    def valid_session(self, session_id):
+        """is this analytics session-id known and unexpired?"""
+        if self.fixed_session_id and session_id == self.fixed_session_id:
+            return True
+        with self.lock:
+            return self.sessions.get(session_id, 0) > time.time()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """routes the login, course, analytics and GraphQL requests"""
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    canvas = None  # set by main
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def send(self, status, body, content_type='text/html', headers=()):
+        body = body if isinstance(body, bytes) else body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def logged_in(self):
+        match = re.search(r'canvas_session=([\w-]+)', self.headers.get('Cookie', ''))
+        return match is not None and match.group(1) in self.canvas.logins
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        match = re.match(r'^/courses/(\d+)(/analytics)?/?$', url.path)
+        if match:
+            course_id, analytics = match.groups()
+            if not self.logged_in():
+                return self.send(200, login_page % {'next': url.path})
+            json_response, _ = self.canvas.course(course_id)
+            if analytics:
+                return self.send(200, analytics_page % {
+                    'session_id': self.canvas.new_session(),
+                    'context_id': json_response['data']['course']['contextId'],
+                    'query': json.dumps(course_detail_query)})
+            return self.send(200, course_page % {'id': course_id, 'name': json_response['data']['course']['name']})
+        if url.path == '/duo':
+            next_url = parse_qs(url.query).get('next', ['/'])[0]
+            return self.send(200, duo_frame % {'next': next_url, 'delay': self.canvas.duo_delay * 1000})
+        self.send(404, 'not found', 'text/plain')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.read_body()
+        if url.path == '/login':
+            next_url = parse_qs(body.decode()).get('next', ['/'])[0]
+            return self.send(200, duo_page % {'next': next_url})
+        if url.path == '/duo/push':
+            cookie = str(uuid.uuid4())
+            self.canvas.logins.add(cookie)
+            return self.send(200, '{}', 'application/json',
+                             [('Set-Cookie', 'canvas_session=%s; Path=/' % cookie)])
+        if url.path.endswith('/graphql'):
+            return self.graphql(body)
+        self.send(404, 'not found', 'text/plain')
+
+    def graphql(self, body):
+        if not self.canvas.valid_session(self.headers.get('session-id')):
+            return self.send(401, '{"errors": [{"message": "invalid session"}]}', 'application/json')
+        try:
+            request = json.loads(body)
+            variables = request.get('variables') or {}
+            course = self.canvas.course_by_context(variables.get('contextId'))
+            if course is None:
+                raise KeyError('unknown contextId')
+            json_response, serialized = course
+            if request.get('operationName') == 'CourseDetail' and variables.get('first') is None:
+                return self.send(200, serialized, 'application/json')
+            if request.get('operationName') == 'CourseDetail':  # the first page
+                page = self.canvas.page(variables['contextId'], variables['first'], variables.get('after'))
+                course = dict(json_response['data']['course'], assignmentsForStudents=page)
+                return self.send(200, json.dumps({'data': {'course': course}}), 'application/json')
+            if request.get('operationName') == 'CourseDetailPage':
+                page = self.canvas.page(variables['contextId'], variables['first'], variables.get('after'))
+                return self.send(200, json.dumps({'data': {'course': {'assignmentsForStudents': page}}}),
+                                 'application/json')
+            if request.get('operationName') == 'CourseWatermark':
+                course = json_response['data']['course']
+                return self.send(200, json.dumps({'data': {'course': {
+                    field: course[field] for field in ('courseId', 'updatedAt', 'etlStart')}}}), 'application/json')
+            if request.get('operationName') == 'StudentCourseGradeQuery':
+                return self.send(200, json.dumps(student_course_grade(json_response, variables.get('studentId'))),
+                                 'application/json')
+            raise KeyError('unknown operation %s' % request.get('operationName'))
+        except (ValueError, KeyError) as e:
+            self.send(200, json.dumps({'errors': [{'message': str(e)}]}), 'application/json')
+
+
+def parse_size(text):
+    """parse STUDENTSxASSIGNMENTS[xSECTIONS]"""
+    parts = [int(x) for x in text.lower().split('x')]
+    return (parts + [8])[:3]
+
+
+def main():
+    """ the main function """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--size', default='1000x50x8',
+                        help='default course size as STUDENTSxASSIGNMENTS[xSECTIONS]')
+    parser.add_argument('--course', action='append', default=[],
+                        help='size of one course as ID:STUDENTSxASSIGNMENTS[xSECTIONS] (repeatable)')
+    parser.add_argument('--session-ttl', type=float, default=3600, help='analytics session lifetime in seconds')
+    parser.add_argument('--duo-delay', type=int, default=1, help='seconds before a Duo push is approved')
+    parser.add_argument('--session-id', help='a fixed analytics session-id that is always accepted (benchmarks)')
+    parser.add_argument('--preload', action='store_true', help='generate the --course courses before serving')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    sizes = {'*': parse_size(args.size)}
+    for course in args.course:
+        course_id, size = course.split(':')
+        sizes[course_id] = parse_size(size)
+    Handler.canvas = MockCanvas(sizes, args.session_ttl, args.duo_delay, args.session_id)
+    if args.preload:
+        for course_id in sizes:
+            if course_id != '*':
+                Handler.canvas.course(course_id)
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    logger.info('Mock Canvas listening on http://%s:%d/courses/<id>' % server.server_address)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
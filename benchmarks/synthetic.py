@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+
+"""
+DESCRIPTION: This script generates synthetic New Analytics CourseDetail responses of any size,
+    shaped like the sample at the bottom of scraper.py.
+INPUT(S):
+    - Number of students, assignments and sections
+"""
+
+import json
+import random
+import hashlib
+import argparse
+
+# first epoch millisecond of the synthetic term
+t0 = 1662000000000
+
+
+def context_id(course_id):
+    """the (stable) analytics contextId of a synthetic course"""
+    return hashlib.sha1(str(course_id).encode()).hexdigest()
+
+
+def synthetic_course(n_students, n_assignments, n_sections, seed=0, course_id='158608'):
+    """build a CourseDetail response of the given size
+        Args:
+            n_students: Number of students (spread round-robin over the sections).
+            n_assignments: Number of assignments; every student gets one
+                assignmentsForStudents row per assignment.
+            n_sections: Number of sections.
+            seed: Random seed, so the same arguments always give the same course.
+            course_id: The Canvas courseId.
+        Returns:
+            The decoded CourseDetail response.
+    """
+    rng = random.Random(seed)
+    n_sections = max(1, n_sections)
+    sections = [{'id': str(45110000000176700 + i), 'name': 'ME_2004_%05d_202209' % (90400 + i),
+                 'hasStudents': True, '__typename': 'Section'} for i in range(n_sections)]
+    students = []
+    for i in range(n_students):
+        section = sections[i % n_sections]
+        students.append({
+            'currentOverallScore': round(rng.uniform(50, 100), 2),
+            'lastParticipationTime': t0 + rng.randrange(10**9),
+            'lastPageviewTime': rng.choice([None, t0 + rng.randrange(10**9)]),
+            'sections': [{'id': section['id'], 'name': section['name'], '__typename': 'SectionEnrollment'}],
+            'student': {'id': str(45110000000170000 + i), 'studentId': str(170000 + i), 'studentInfo': {
+                'onTimePercentage': round(rng.uniform(0, 100), 1), 'name': 'Student %d' % i, 'shortName': None,
+                'sortableName': '%d, Student' % i, 'lastLoggedOut': None, 'avatarURL': None,
+                'email': 's%d@vt.edu' % i, 'sisId': str(906000000 + i), '__typename': 'StudentInfo'},
+                '__typename': 'Student'},
+            '__typename': 'StudentInCourse'})
+    assignments = []
+    for j in range(n_assignments):
+        stats = {'min': 0, 'mean': rng.uniform(50, 100), 'max': 100, 'missing': [], 'late': [], '__typename': 'AssignmentStats'}
+        assignments.append({'assignment': {
+            'id': str(45110000001559000 + j), 'name': 'Assignment %d' % j, 'stats': stats,
+            'sectionStats': [{'sectionId': s['id'], 'stats': dict(stats), '__typename': 'SectionStats'} for s in sections],
+            'dueDate': rng.choice([None, t0 + rng.randrange(10**9)]), 'maxScoreRaw': 10, 'gradingType': 'points',
+            'assignmentType': 'ASSIGNMENT', 'sectionOverrides': [], '__typename': 'Assignment'},
+            '__typename': 'AssignmentForCourse'})
+    activity = []
+    for j, a in enumerate(assignments):
+        for s in students:
+            score = rng.choice([None, rng.randrange(11)])
+            activity.append({
+                'assignmentId': a['assignment']['id'], 'assignmentName': a['assignment']['name'],
+                'studentId': s['student']['id'],
+                'cursor': '%s|%s|cursor' % (a['assignment']['id'], s['student']['id']),
+                'dueDate': a['assignment']['dueDate'], 'excused': False, 'late': rng.random() < 0.1,
+                'missing': score is None,
+                'submissions': [] if score is None else [{
+                    'date': t0 + rng.randrange(10**9), 'gradeRaw': str(score), 'scoreRaw': score,
+                    'percentage': score * 10, '__typename': 'Submission'}],
+                '__typename': 'StudentAssignment'})
+    return {'data': {'course': {
+        'contextId': context_id(course_id), 'tcGuid': 'synthetic:canvas-lms',
+        'courseId': str(course_id), 'name': 'Synthetic Course %s' % course_id, 'startDate': None,
+        'etlStart': t0, 'updatedAt': t0, 'mean': 90.0, 'sections': sections,
+        'assignmentForCourseConnection': {'edges': assignments, '__typename': 'AssignmentForCourseConnection'},
+        'assignmentsForStudents': activity,
+        'studentInCourseConnection': {'edges': students, '__typename': 'StudentInCourseConnection'},
+        '__typename': 'Course'}}}
+
+
+def student_course_grade(json_response, student_id):
+    """build the StudentCourseGradeQuery response for one student of a synthetic course"""
+    course = json_response['data']['course']
+    student = next((s for s in course['studentInCourseConnection']['edges']
+                    if s['student']['id'] == student_id), None)
+    return {'data': {'course': {
+        'assignmentForCourseConnection': {'edges': [
+            {'assignment': {'id': a['assignment']['id'], 'assignmentType': a['assignment']['assignmentType'],
+                            '__typename': 'Assignment'}, '__typename': 'AssignmentForCourse'}
+            for a in course['assignmentForCourseConnection']['edges']],
+            '__typename': 'AssignmentForCourseConnection'},
+        'assignmentsForStudent': [a for a in course['assignmentsForStudents'] if a['studentId'] == student_id],
+        'studentInCourse': student,
+        '__typename': 'Course'}}}
+
+
+def main():
+    """ the main function """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output', help='JSON file to write')
+    parser.add_argument('--students', type=int, default=1000)
+    parser.add_argument('--assignments', type=int, default=50)
+    parser.add_argument('--sections', type=int, default=8)
+    parser.add_argument('--course-id', default='158608')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    with open(args.output, 'w') as f:
+        json.dump(synthetic_course(args.students, args.assignments, args.sections, args.seed, args.course_id), f)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,422 @@
+#!/usr/bin/python3
+
+"""
+DESCRIPTION: Long-lived scraper daemon. It keeps a pool of warm headless browsers (and the Canvas
+    cookies and analytics sessions) between jobs and takes scrape jobs over a local Unix socket
+    or TCP port, so a job starts in well under a second instead of waiting for Chrome and a login.
+    Run with: python scraper.py daemon username password
+    Submit with: python scraper.py submit course_url ...
+    The protocol is one JSON object per line each way, e.g.,
+        {"course_url": "https://canvas.vt.edu/courses/123456", "out_dir": "/data/123456", "format": "csv"}
+        {"status": "ok", "course_url": "...", "out_dir": "/data/123456", "seconds": 0.8}
+    and {"command": "status"} for the state of the pool. Over TCP (--port) every request must also
+    carry the daemon's token, {"token": "..."}, which the daemon writes to --token-file (readable only
+    by its owner) at start-up; submit reads it from there.
+INPUT(S):
+    - Canvas credentials (daemon); course URLs and output options (submit)
+"""
+
+import os
+import io
+import sys
+import hmac
+import json
+import time
+import queue
+import signal
+import socket
+import secrets
+import logging
+import argparse
+import threading
+import socketserver
+from contextlib import contextmanager, nullcontext
+
+import scraper
+from transform import output_formats, course_field
+from raw_archive import save_payload
+import store
+import warehouse
+
+logger = logging.getLogger('scraper.daemon')
+
+# where the daemon listens by default
+default_socket = '.scraper.sock'
+# where the daemon keeps the token TCP clients must send
+default_token_file = '.scraper_token'
+
+
+#
+# driver pool
+#
+class DriverPool:
+    """a pool of warm selenium-wire drivers, recycled by health, age and use
+        Args:
+            size: The number of drivers.
+            max_age: Seconds before a driver is replaced.
+            max_jobs: Jobs before a driver is replaced.
+            block_resources: See scraper.create_driver.
+    """
+
+    def __init__(self, size, max_age, max_jobs, block_resources=True):
+        self.size = size
+        self.block_resources = block_resources
+        self.max_age = max_age
+        self.max_jobs = max_jobs
+        self.idle = queue.Queue()
+        self.started = 0
+        self.retired = 0
+        threads = [threading.Thread(target=self.add_driver) for _ in range(size)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def add_driver(self):
+        """start a driver and put it in the pool"""
+        try:
+            self.idle.put({'driver': scraper.create_driver(self.block_resources), 'started': time.time(), 'jobs': 0})
+            self.started += 1
+        except Exception as e:  # ooops!
+            logger.error('Could not start a browser (%s).' % e)
+
+    def retire(self, entry):
+        """quit a driver"""
+        self.retired += 1
+        try:
+            entry['driver'].quit()
+        except Exception:  # already gone
+            pass
+
+    def healthy(self, entry):
+        """is the driver young enough and still responding?"""
+        if time.time() - entry['started'] > self.max_age or entry['jobs'] >= self.max_jobs:
+            return False
+        try:
+            return entry['driver'].execute_script('return 1') == 1
+        except Exception:  # crashed browser or chromedriver
+            return False
+
+    def replace(self, entry):
+        """retire a driver and start its replacement in the background"""
+        self.retire(entry)
+        threading.Thread(target=self.add_driver, daemon=True).start()
+
+    @contextmanager
+    def driver(self, timeout=None):
+        """borrow a healthy driver; one that fails a job is replaced rather than returned"""
+        try:
+            entry = self.idle.get(timeout=timeout)
+            while not self.healthy(entry):
+                self.replace(entry)
+                entry = self.idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError('no browser became free in %s s' % timeout)
+        try:
+            yield entry['driver']
+        except BaseException:
+            self.replace(entry)
+            raise
+        entry['jobs'] += 1
+        self.idle.put(entry)
+
+    def maintain(self):
+        """replace the idle drivers that are too old or no longer respond"""
+        for _ in range(self.idle.qsize()):
+            try:
+                entry = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            if self.healthy(entry):
+                self.idle.put(entry)
+            else:
+                logger.info('Recycling a browser after %d jobs and %.0f s.' % (
+                    entry['jobs'], time.time() - entry['started']))
+                self.replace(entry)
+
+    def close(self):
+        """quit every idle driver"""
+        while True:
+            try:
+                self.retire(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+    def status(self):
+        return {'size': self.size, 'idle': self.idle.qsize(), 'started': self.started, 'retired': self.retired}
+
+
+#
+# jobs
+#
+class Daemon:
+    """runs scrape jobs over the shared driver pool and session cache"""
+
+    def __init__(self, args):
+        self.args = args
+        self.cache = scraper.load_session_cache(args.session_cache) if not args.no_session_cache \
+            else {'cookies': [], 'courses': {}}
+        self.http = scraper.create_http_session(args.workers)
+        self.lock = threading.Lock()  # guards the session cache
+        self.login_lock = threading.Lock()  # one 2FA push at a time
+        self.pool = DriverPool(args.workers, args.max_driver_age, args.max_driver_jobs, not args.no_block)
+        self.jobs = 0
+        self.failed = 0
+
+    def save_cache(self, course_url, analytics_session, cookies):
+        """remember the cookies and the course's analytics session"""
+        with self.lock:
+            self.cache['cookies'] = cookies
+            analytics_session['saved_at'] = time.time()
+            self.cache.setdefault('courses', {})[course_url] = analytics_session
+            if not self.args.no_session_cache:
+                scraper.save_session_cache(self.args.session_cache, self.cache)
+
+    def fetch(self, course_url):
+        """get a course's CourseDetail response: from a cached session if possible, else a pooled browser"""
+        args = self.args
+        body = scraper.fetch_cached_course_detail(self.http, self.cache, course_url, args.max_session_age,
+                                                  None, args.page_size, args.page_workers)
+        if body is not None:
+            return body
+        # without valid cookies the capture logs in, so let one job do that and the rest reuse its cookies
+        with self.login_lock if scraper.fresh_cookies(self.cache) is None else nullcontext():
+            with self.pool.driver(timeout=args.job_timeout) as driver:
+                body, analytics_session = scraper.capture_course_detail(
+                    driver, course_url, args.username, args.password, scraper.fresh_cookies(self.cache),
+                    args.replay or bool(args.page_size), None, args.page_size, args.page_workers)
+                cookies = driver.get_cookies()
+            self.save_cache(course_url, analytics_session, cookies)
+        return body
+
+    def run(self, job):
+        """run one job and describe the outcome"""
+        start = time.time()
+        course_url = job['course_url']
+        body = self.fetch(course_url)
+        if not self.args.no_archive:
+            save_payload(body, self.args.archive_dir, course_url)
+        out_dir = job.get('out_dir') or '.'
+        if job.get('per_course'):
+            out_dir = os.path.join(out_dir, str(course_field(io.BytesIO(body), 'courseId')))
+        scraper.write_course(body, out_dir, job.get('stream', False), job.get('format', 'csv'),
+                             job.get('incremental', False), job.get('normalize', False), course_url=course_url,
+                             summaries=job.get('summaries', False), compact=job.get('compact', False))
+        if self.args.store:
+            store.load_course(self.args.store, body, time.time())
+        if self.args.warehouse:
+            warehouse.load_snapshot(self.args.warehouse, body, time.time())
+        return {'status': 'ok', 'course_url': course_url, 'out_dir': out_dir, 'seconds': time.time() - start}
+
+    def handle(self, request):
+        """answer one request"""
+        if request.get('command') == 'status':
+            return {'status': 'ok', 'jobs': self.jobs, 'failed': self.failed, 'pool': self.pool.status()}
+        self.jobs += 1
+        try:
+            error = scraper.option_error(request.get('stream', False), request.get('format', 'csv'),
+                                         request.get('incremental', False), request.get('normalize', False),
+                                         request.get('summaries', False), request.get('compact', False))
+            if error:
+                raise ValueError(error)
+            logger.info('Job %s...' % request.get('course_url'))
+            reply = self.run(request)
+            logger.info('Job %(course_url)s done in %(seconds).2f s.' % reply)
+            return reply
+        except Exception as e:  # ooops!
+            self.failed += 1
+            logger.error('Job %s failed (%s).' % (request.get('course_url'), e))
+            return {'status': 'error', 'course_url': request.get('course_url'), 'error': str(e)}
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """reads JSON requests, one per line, and writes one JSON reply per request"""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                token = getattr(self.server, 'token', None)
+                if token is not None and not hmac.compare_digest(str(request.get('token', '')), token):
+                    reply = {'status': 'error', 'error': 'bad or missing token'}
+                else:
+                    reply = self.server.daemon.handle(request)
+            except ValueError as e:
+                reply = {'status': 'error', 'error': 'bad request (%s)' % e}
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+            self.wfile.flush()
+
+
+def unix_server(path):
+    """a threaded Unix socket server; the class is only defined here, as Windows has no AF_UNIX"""
+    class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+    return UnixServer(path, Handler)
+
+
+class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+#
+# commands
+#
+def build_daemon_parser():
+    """the command line parser of the daemon command"""
+    parser = argparse.ArgumentParser(prog='scraper.py daemon',
+                                     description='keep warm browsers and serve scrape jobs over a local socket')
+    parser.add_argument('username', help='Username')
+    parser.add_argument('password', help='Password')
+    parser.add_argument('--socket', default=default_socket, help='Unix socket to listen on')
+    parser.add_argument('--port', type=int, help='listen on this localhost TCP port instead of a Unix socket')
+    parser.add_argument('--token-file', default=default_token_file,
+                        help='with --port, the file the daemon writes the token clients must send to')
+    parser.add_argument('--workers', type=int, default=2, help='number of warm browsers')
+    parser.add_argument('--max-driver-age', type=float, default=60*60, help='seconds before a browser is replaced')
+    parser.add_argument('--max-driver-jobs', type=int, default=50, help='jobs before a browser is replaced')
+    parser.add_argument('--maintain-every', type=float, default=60,
+                        help='seconds between health and age checks of the idle browsers')
+    parser.add_argument('--job-timeout', type=float, default=600, help='seconds a job waits for a free browser')
+    parser.add_argument('--login-url', help='a course URL to log on to at start-up, so the first job skips 2FA')
+    parser.add_argument('--replay', action='store_true', help='see scraper.py --help')
+    parser.add_argument('--page-size', type=int, help='see scraper.py --help')
+    parser.add_argument('--page-workers', type=int, default=4, help='see scraper.py --help')
+    parser.add_argument('--session-cache', default='.scraper_session.json', help='see scraper.py --help')
+    parser.add_argument('--max-session-age', type=float, default=8*60*60, help='see scraper.py --help')
+    parser.add_argument('--no-session-cache', action='store_true', help='see scraper.py --help')
+    parser.add_argument('--no-block', action='store_true', help='see scraper.py --help')
+    parser.add_argument('--store', help='see scraper.py --help')
+    parser.add_argument('--warehouse', help='see scraper.py --help')
+    parser.add_argument('--archive-dir', default='raw', help='see scraper.py --help')
+    parser.add_argument('--no-archive', action='store_true', help='see scraper.py --help')
+    return parser
+
+
+def daemon(argv=None):
+    """run the daemon until interrupted"""
+    parser = build_daemon_parser()
+    args = parser.parse_args(argv)
+    if not args.port and not hasattr(socket, 'AF_UNIX'):
+        parser.error('Unix sockets are not available here, use --port')
+    scraper.configure_logging()
+    logger.info('Starting %d browsers...' % args.workers)
+    service = Daemon(args)
+    if args.login_url and scraper.fresh_cookies(service.cache) is None:
+        with service.pool.driver() as driver:
+            scraper.login(driver, args.login_url, args.username, args.password)
+            service.cache['cookies'] = driver.get_cookies()
+
+    if args.port:
+        server = TCPServer(('127.0.0.1', args.port), Handler)
+        # any local user can reach the port, so jobs need the token only the owner can read
+        server.token = secrets.token_hex(16)
+        fd = os.open(args.token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(server.token)
+        address = '127.0.0.1:%d' % args.port
+    else:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)  # left over from a daemon that did not shut down cleanly
+        server = unix_server(args.socket)
+        os.chmod(args.socket, 0o600)  # jobs run with the owner's Canvas session
+        address = args.socket
+    server.daemon = service
+
+    def maintain():
+        while True:
+            time.sleep(args.maintain_every)
+            service.pool.maintain()
+
+    threading.Thread(target=maintain, daemon=True).start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # shut down cleanly under a service manager
+    logger.info('Listening on %s.' % address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.token_file if args.port else args.socket)
+        service.pool.close()
+        logger.info('Daemon stopped.')
+
+
+def connect(args):
+    """open a connection to the daemon"""
+    if args.port:
+        return socket.create_connection(('127.0.0.1', args.port))
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(args.socket)
+    return client
+
+
+def request(args, message):
+    """send one request to the daemon and wait for the reply"""
+    if args.port:
+        with open(args.token_file) as f:
+            message = dict(message, token=f.read().strip())
+    with connect(args) as client, client.makefile('rwb') as f:
+        f.write(json.dumps(message).encode() + b'\n')
+        f.flush()
+        return json.loads(f.readline())
+
+
+def build_submit_parser():
+    """the command line parser of the submit command"""
+    parser = argparse.ArgumentParser(prog='scraper.py submit', description='send scrape jobs to a running daemon')
+    parser.add_argument('course_url', nargs='*', help='Course URL(s)')
+    parser.add_argument('--socket', default=default_socket, help='Unix socket of the daemon')
+    parser.add_argument('--port', type=int, help='localhost TCP port of the daemon')
+    parser.add_argument('--token-file', default=default_token_file, help='the token file of a --port daemon')
+    parser.add_argument('--status', action='store_true', help='print the state of the daemon')
+    parser.add_argument('--out-dir', default='.',
+                        help='output folder; with several courses each one is written to OUT_DIR/<courseId>/')
+    parser.add_argument('--stream', action='store_true', help='see scraper.py --help')
+    parser.add_argument('--format', default='csv', choices=output_formats, help='see scraper.py --help')
+    parser.add_argument('--normalize', action='store_true', help='see scraper.py --help')
+    parser.add_argument('--incremental', action='store_true', help='see scraper.py --help')
+    parser.add_argument('--summaries', action='store_true', help='see scraper.py --help')
+    parser.add_argument('--compact', action='store_true', help='see scraper.py --help')
+    return parser
+
+
+def submit(argv=None):
+    """send jobs to the daemon, one connection per course so they run in parallel"""
+    parser = build_submit_parser()
+    args = parser.parse_args(argv)
+    if args.status:
+        try:
+            print(json.dumps(request(args, {'command': 'status'}), indent=2))
+        except OSError as e:
+            sys.exit('The daemon is not running (%s).' % e)
+        return
+    if not args.course_url:
+        parser.error('at least one course URL is required')
+    error = scraper.option_error(args.stream, args.format, args.incremental, args.normalize, args.summaries,
+                                 args.compact)
+    if error:
+        parser.error(error)
+    replies = {}
+
+    def send(course_url):
+        try:
+            replies[course_url] = request(args, {
+                'course_url': course_url, 'out_dir': os.path.abspath(args.out_dir),
+                'per_course': len(args.course_url) > 1, 'stream': args.stream, 'format': args.format,
+                'normalize': args.normalize, 'incremental': args.incremental, 'summaries': args.summaries,
+                'compact': args.compact})
+        except (OSError, ValueError) as e:
+            replies[course_url] = {'status': 'error', 'course_url': course_url, 'error': str(e)}
+
+    threads = [threading.Thread(target=send, args=(course_url,)) for course_url in args.course_url]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for course_url in args.course_url:
+        print(json.dumps(replies[course_url]))
+    if any(reply['status'] != 'ok' for reply in replies.values()):
+        sys.exit(1)
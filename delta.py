@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+"""
+DESCRIPTION: Incremental (delta) scraping state: the course watermark and per-row hashes
+    of the last snapshot written to an output folder.
+INPUT(S):
+    - The tables from transform.course_frames
+"""
+
+import os
+import io
+import json
+import hashlib
+
+from transform import course_field
+
+# state file kept next to the outputs
+state_file = '.scrape_state.json'
+# the columns that identify a row of each table
+table_keys = {
+    'students': ['student.id'],
+    'assignments': ['assignment.id'],
+    'student_assignment_activity': ['assignmentId', 'studentId'],
+}
+
+
+def load_state(out_dir):
+    """load the state of the last snapshot written to out_dir, or None"""
+    try:
+        with open(os.path.join(out_dir, state_file)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(out_dir, state):
+    """save the snapshot state, replacing the old one atomically"""
+    path = os.path.join(out_dir, state_file)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def course_watermark(body):
+    """the course's (updatedAt, etlStart) watermark, read from the start of a raw CourseDetail response"""
+    return [course_field(io.BytesIO(body), 'updatedAt'), course_field(io.BytesIO(body), 'etlStart')]
+
+
+def row_hash(columns, row, na):
+    """hash one row on its own, from its present values only
+        A row's hash does not depend on the rest of the table: the numbered list
+        columns (sections.N.*, submissions.N.*) that other rows add or drop are
+        empty in this row and left out, and integral floats hash as ints, so a
+        column widened to float by gaps in other rows hashes the same.
+        Args:
+            columns: The column names, sorted.
+            row: The row's values, in column order.
+            na: pandas.NA (None, NaN and NaT are recognized without it).
+    """
+    values = [(name, int(value) if type(value) is float and value.is_integer() else value)
+              for name, value in zip(columns, row) if value is not None and value is not na and value == value]
+    return hashlib.blake2b(repr(values).encode(), digest_size=8).hexdigest()
+
+
+def row_hashes(frame, table):
+    """hash every row of a table
+        Returns:
+            Lists of the row keys (ID columns joined with |) and row hashes, in row order.
+    """
+    import pandas as pd
+    if frame.empty:
+        return [], []
+    keys = ['|'.join(map(str, key)) for key in zip(*(frame[name].tolist() for name in table_keys[table]))]
+    columns = sorted(frame.columns, key=str)
+    rows = zip(*(frame[name].tolist() for name in columns))
+    names = [str(name) for name in columns]
+    return keys, [row_hash(names, row, pd.NA) for row in rows]
+
+
+def diff_table(frame, table, old_hashes):
+    """work out the rows added, changed or removed since the last snapshot
+        Args:
+            frame: The current table.
+            table: The table name (see table_keys).
+            old_hashes: The row hashes of the last snapshot, keyed by row key.
+        Returns:
+            A tuple of the delta table (the current row for added/changed rows,
+            just the key columns for removed rows, and a change column) and the
+            current row hashes keyed by row key.
+    """
+    import pandas as pd
+    keys, hashes = row_hashes(frame, table)
+    changes = [None if old_hashes.get(key) == h else ('changed' if key in old_hashes else 'added')
+               for key, h in zip(keys, hashes)]
+    delta = frame[pd.Series([change is not None for change in changes], index=frame.index, dtype=bool)].copy()
+    delta.insert(0, 'change', [change for change in changes if change is not None])
+    current = dict(zip(keys, hashes))
+    removed = [key.split('|') for key in old_hashes if key not in current]
+    if removed:
+        removed = pd.DataFrame(removed, columns=table_keys[table])
+        removed.insert(0, 'change', 'removed')
+        delta = pd.concat([delta, removed], ignore_index=True)
+    return delta, current
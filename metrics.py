@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+
+"""
+DESCRIPTION: Per-stage instrumentation for scraper runs: wall time, peak memory, row counts and
+    payload bytes, written as a JSON metrics file and a Prometheus textfile-collector file.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Prometheus metric name prefix
+prefix = 'canvas_scraper'
+
+
+def peak_rss_bytes():
+    """peak resident set size of this process so far, or None where it cannot be measured (Windows)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # bytes on macOS, KiB elsewhere
+
+
+class Metrics:
+    """the stage records of one run
+        Args:
+            trace_memory: Also record the peak Python heap of each stage with
+                tracemalloc (slows the run down noticeably).
+    """
+
+    def __init__(self, trace_memory=False):
+        self.run_id = time.strftime('%Y%m%dT%H%M%S') + '-' + uuid.uuid4().hex[:8]
+        self.started = time.time()
+        self.stages = []
+        self.lock = threading.Lock()
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """time a stage; the caller may add rows and bytes to the yielded record
+            Example:
+                with metrics.stage('decode', course=url) as record:
+                    record['bytes'] = len(body)
+        """
+        record = {'stage': name, 'labels': labels, 'rows': None, 'bytes': None}
+        if self.trace_memory:
+            tracemalloc.reset_peak()  # shared by concurrent stages, so approximate in batch runs
+        start = time.perf_counter()
+        try:
+            yield record
+            record['status'] = 'ok'
+        except BaseException:
+            record['status'] = 'error'
+            raise
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            record['peak_rss_bytes'] = peak_rss_bytes()
+            if self.trace_memory:
+                record['peak_python_bytes'] = tracemalloc.get_traced_memory()[1]
+            with self.lock:
+                self.stages.append(record)
+
+    def to_dict(self):
+        """the run as a JSON-serializable dict"""
+        with self.lock:
+            stages = list(self.stages)
+        return {'run_id': self.run_id, 'started': self.started, 'seconds': time.time() - self.started,
+                'peak_rss_bytes': peak_rss_bytes(), 'stages': stages}
+
+    def write_json(self, path):
+        """write the run's metrics as JSON"""
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def write_prometheus(self, path):
+        """write the run's metrics in the Prometheus text format, for node_exporter's textfile collector
+            The file is replaced atomically so the collector never reads a partial file.
+        """
+        run = self.to_dict()
+        series = {
+            'stage_seconds': ('gauge', 'Wall time of the stage in seconds.', 'seconds'),
+            'stage_peak_rss_bytes': ('gauge', 'Peak resident set size of the process at the end of the stage.',
+                                     'peak_rss_bytes'),
+            'stage_peak_python_bytes': ('gauge', 'Peak traced Python heap during the stage.', 'peak_python_bytes'),
+            'stage_rows': ('gauge', 'Rows produced by the stage.', 'rows'),
+            'stage_bytes': ('gauge', 'Payload bytes handled by the stage.', 'bytes'),
+            'stage_memory_bytes': ('gauge', 'Memory held by the tables the stage built.', 'memory_bytes'),
+        }
+        lines = []
+        for name, (kind, help_text, field) in series.items():
+            samples = [(s, s[field]) for s in run['stages'] if s.get(field) is not None]
+            if not samples:
+                continue
+            lines += ['# HELP %s_%s %s' % (prefix, name, help_text), '# TYPE %s_%s %s' % (prefix, name, kind)]
+            for s, value in samples:
+                labels = dict(s['labels'], stage=s['stage'], status=s['status'])
+                lines.append('%s_%s{%s} %s' % (prefix, name, ','.join(
+                    '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in sorted(labels.items())),
+                    repr(float(value))))
+        lines += ['# HELP %s_run_seconds Wall time of the whole run.' % prefix,
+                  '# TYPE %s_run_seconds gauge' % prefix,
+                  '%s_run_seconds %r' % (prefix, float(run['seconds'])),
+                  '# HELP %s_run_timestamp_seconds When the run started.' % prefix,
+                  '# TYPE %s_run_timestamp_seconds gauge' % prefix,
+                  '%s_run_timestamp_seconds %r' % (prefix, float(run['started']))]
+        with open(path + '.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+
+def stage(metrics, name, **labels):
+    """metrics.stage(name, **labels), or a no-op when metrics is None"""
+    return metrics.stage(name, **labels) if metrics is not None else nullcontext({})
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+"""
+DESCRIPTION: Cursor pagination of the CourseDetail assignmentsForStudents list, which holds one
+    row per student per assignment and so dominates the response of large courses.
+    Every row carries a cursor of the form <assignmentId>|<studentId>|cursor, and the rows come
+    assignment by assignment in roster order, so once the first page (with the roster and the
+    assignments) is in, the cursor that starts every later page can be predicted and the pages
+    fetched in parallel. Predictions are checked against the pages received; when they do not hold
+    (e.g., a student without a row for some assignment) the remaining pages are followed one at a time.
+INPUT(S):
+    - The CourseDetail query text captured from the New Analytics page
+"""
+
+import re
+import json
+
+# the list that is paged, and its row cursor
+paged_field = 'assignmentsForStudents'
+cursor_format = '%s|%s|cursor'
+
+
+def find_field(query, field):
+    """find the first occurrence of field in a GraphQL query
+        Returns:
+            A tuple of the positions where the field starts, where its { ... }
+            selection set starts and where the selection set ends.
+    """
+    match = re.search(r'\b%s\b\s*(\([^)]*\))?\s*\{' % field, query)
+    if match is None:
+        raise ValueError('%s not found in the query' % field)
+    depth = 0
+    for i in range(match.end() - 1, len(query)):
+        if query[i] == '{':
+            depth += 1
+        elif query[i] == '}':
+            depth -= 1
+            if depth == 0:
+                return match.start(), match.end() - 1, i + 1
+    raise ValueError('unbalanced query')
+
+
+def row_fields(query):
+    """the selection set of assignmentsForStudents, making sure it asks for the row cursor"""
+    _, start, end = find_field(query, paged_field)
+    fields = query[start:end]
+    return fields if re.search(r'\bcursor\b', fields) else fields[:-1].rstrip() + ' cursor }'
+
+
+def head_query(query):
+    """turn a CourseDetail query into one whose assignmentsForStudents takes first/after arguments"""
+    match = re.match(r'\s*query\s+\w+\s*\(([^)]*)\)', query)
+    if match is None:
+        raise ValueError('the query has no variable definitions')
+    query = query[:match.end(1)] + ', $first: Int, $after: String' + query[match.end(1):]
+    field, _, end = find_field(query, paged_field)
+    return query[:field] + '%s(first: $first, after: $after) %s' % (paged_field, row_fields(query)) + query[end:]
+
+
+def page_query(query):
+    """a query for one page of assignmentsForStudents alone, with the captured row fields"""
+    return ('query CourseDetailPage($contextId: String!, $tcGuid: String!, $first: Int, $after: String) '
+            '{ course(contextId: $contextId, tcGuid: $tcGuid) { %s(first: $first, after: $after) %s } }'
+            % (paged_field, row_fields(query)))
+
+
+def predicted_cursors(course, page_size):
+    """the cursors expected to end each page of assignmentsForStudents
+        Args:
+            course: The course of the first page, with the roster and the assignments.
+            page_size: The rows per page.
+        Returns:
+            The after cursor of every page after the first, assuming one row per
+            student per assignment, assignment by assignment in roster order.
+    """
+    students = [edge['student']['id'] for edge in course['studentInCourseConnection']['edges']]
+    assignments = [edge['assignment']['id'] for edge in course['assignmentForCourseConnection']['edges']]
+    total = len(students) * len(assignments)
+    return [cursor_format % (assignments[(i - 1) // len(students)], students[(i - 1) % len(students)])
+            for i in range(page_size, total, page_size)]
+
+
+def merged_body(course, pages):
+    """write a CourseDetail response whose assignmentsForStudents is the concatenation of the pages
+        Args:
+            course: The course of the first page; its assignmentsForStudents is replaced.
+            pages: An iterator of lists of rows, in order; each page is serialized
+                as it arrives, so only one page is decoded at a time.
+        Returns:
+            The raw response body, laid out like an unpaged CourseDetail response.
+    """
+    placeholder = '\0pages\0'
+    course[paged_field] = placeholder  # keeps the list's place among the course's fields
+    head, tail = json.dumps({'data': {'course': course}}).split(json.dumps(placeholder), 1)
+    parts = [json.dumps(rows)[1:-1].encode() for rows in pages if rows]
+    return head.encode() + b'[' + b', '.join(parts) + b']' + tail.encode()
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+
+"""
+DESCRIPTION: Content-addressed archive of raw CourseDetail responses, so outputs can be rebuilt
+    offline (see scraper.py reprocess) without logging on to Canvas again.
+    Each response is stored once, gzip compressed, as ARCHIVE_DIR/<sha256[:2]>/<sha256>.json.gz,
+    where sha256 is the hash of the uncompressed response. Every run that saves a response adds
+    a line to ARCHIVE_DIR/manifest.jsonl naming the course, its watermark and the file.
+INPUT(S):
+    - Raw (decoded) CourseDetail response bodies
+"""
+
+import os
+import io
+import gzip
+import json
+import mmap
+import time
+import hashlib
+
+from transform import course_field
+
+# the suffix of archived responses
+suffix = '.json.gz'
+# one JSON line per saved response
+manifest_file = 'manifest.jsonl'
+
+
+def payload_path(archive_dir, digest):
+    """where the response with this sha256 is stored"""
+    return os.path.join(archive_dir, digest[:2], digest + suffix)
+
+
+def save_payload(body, archive_dir, course_url=None, run_id=None):
+    """archive a raw CourseDetail response
+        Identical responses share one file; the manifest records every save.
+        Args:
+            body: The raw CourseDetail response body.
+            archive_dir: The archive folder.
+            course_url: The course, recorded in the manifest.
+            run_id: The run, recorded in the manifest.
+        Returns:
+            The path of the archived response.
+    """
+    digest = hashlib.sha256(body).hexdigest()
+    path = payload_path(archive_dir, digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(gzip.compress(body, compresslevel=6))
+        os.replace(path + '.tmp', path)
+    entry = {'sha256': digest, 'path': os.path.relpath(path, archive_dir), 'course_url': course_url,
+             'courseId': course_field(io.BytesIO(body), 'courseId'),
+             'updatedAt': course_field(io.BytesIO(body), 'updatedAt'),
+             'etlStart': course_field(io.BytesIO(body), 'etlStart'),
+             'bytes': len(body), 'saved_at': time.time(), 'run_id': run_id}
+    with open(os.path.join(archive_dir, manifest_file), 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+    return path
+
+
+def load_payload(path, verify=True):
+    """read an archived response through a memory map and decompress it
+        Args:
+            path: The archived response file.
+            verify: Check the response against the sha256 in its file name.
+        Returns:
+            The raw CourseDetail response body.
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        body = gzip.decompress(mapped)
+    if verify:
+        digest = os.path.basename(path)[:-len(suffix)]
+        if hashlib.sha256(body).hexdigest() != digest:
+            raise ValueError('%s is corrupt (sha256 mismatch)' % path)
+    return body
+
+
+def payload_info(path):
+    """read the courseId, updatedAt and etlStart from the start of an archived response"""
+    info = {}
+    for name in ('courseId', 'updatedAt', 'etlStart'):
+        with gzip.open(path, 'rb') as f:  # only the first few KB are decompressed
+            info[name] = course_field(f, name)
+    return info
+
+
+def find_payloads(paths):
+    """list the archived responses in the given files and archive folders"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                found += [os.path.join(root, name) for name in sorted(files) if name.endswith(suffix)]
+        else:
+            found.append(path)
+    return found
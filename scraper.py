@@ -12,177 +12,1071 @@ import sys
 import logging
 import argparse
 import re
+import os
+import io
 import json
 import time
-# automate Chrome
-logging.getLogger('seleniumwire').setLevel(logging.ERROR)
-from seleniumwire import webdriver
-from seleniumwire.utils import decode
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-# csv output
-import pandas as pd
+import importlib
+import queue
+import threading
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+# NOTE: selenium-wire, requests and pandas are imported where they are first needed (pandas by
+# transform and delta), so importing this module or running --help stays cheap and side-effect free
+from metrics import Metrics, stage
+from transform import (output_formats, course_rows, rows_frames, normalized_frames, course_field,
+                       write_course_csv_stream, write_table, frames_memory)
+from delta import load_state, save_state, course_watermark, row_hashes, diff_table
+from pagination import paged_field, head_query, page_query, predicted_cursors, merged_body
+from analytics import summary_frames
+import store
+import warehouse
+from raw_archive import save_payload, load_payload, payload_info, find_payloads
 
-#
-# logging
-#
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s - %(message)s',
-    handlers=[
-        logging.FileHandler('scraper.log'),
-        logging.StreamHandler()
-    ])
 logger = logging.getLogger('scraper')
 
+
 #
 # command line
 #
-parser = argparse.ArgumentParser()
-parser.add_argument('username', help='Username')
-parser.add_argument('password', help='Password')
-parser.add_argument('course_url', help='Course URL')
-args = parser.parse_args()
-# get canvas course URL from the command line
-course_url = args.course_url  # e.g., 'https://canvas.vt.edu/courses/123456'
-# get credentials from command line
-username = args.username
-password = args.password
+def build_parser():
+    """the command line parser"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('username', help='Username')
+    parser.add_argument('password', help='Password')
+    parser.add_argument('course_url', nargs='*', help='Course URL(s)')
+    parser.add_argument('--courses', help='file with one course URL per line (added to any course_url arguments)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='number of browsers (and HTTP connections) used to scrape courses in parallel')
+    parser.add_argument('--out-dir', default=None,
+                        help='output folder; with several courses each one is written to OUT_DIR/<courseId>/')
+    parser.add_argument('--stream', action='store_true',
+                        help='parse the response incrementally and write the CSV files in chunks (bounded memory)')
+    parser.add_argument('--format', default='csv', choices=output_formats,
+                        help='output format; all but csv use a typed schema (int64 IDs, datetime64 dates, bool flags)')
+    parser.add_argument('--normalize', action='store_true',
+                        help='write long child tables (student_sections, assignment_section_stats, submissions, ...) '
+                             'linked by IDs instead of numbered columns')
+    parser.add_argument('--summaries', action='store_true',
+                        help='also write per-student, per-section and per-assignment summaries (late/missing/excused '
+                             'counts, on-time rates, score and submission lead time quantiles)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='skip unchanged courses and write only the rows added, changed or removed since the last run')
+    parser.add_argument('--compact', action='store_true',
+                        help='hold the tables in compact form (int64 IDs, categorical names, bool flags, datetime64 '
+                             'dates); they take a fraction of the memory')
+    parser.add_argument('--replay', action='store_true',
+                        help='after login, fetch CourseDetail directly over HTTP instead of waiting for the page to load it')
+    parser.add_argument('--metrics-dir',
+                        help='write per-stage metrics for the run to METRICS_DIR/metrics_<run>.json and METRICS_DIR/scraper.prom')
+    parser.add_argument('--profile-transform', metavar='PROFILE',
+                        help='profile the transform stage with cProfile and save the stats to PROFILE')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='record the peak Python heap of every stage with tracemalloc (slower)')
+    parser.add_argument('--session-cache', default='.scraper_session.json',
+                        help='file used to save and reuse cookies and analytics sessions between runs')
+    parser.add_argument('--max-session-age', type=float, default=8*60*60,
+                        help='seconds before a cached analytics session is considered stale')
+    parser.add_argument('--no-session-cache', action='store_true',
+                        help='always log in interactively and do not save the session')
+    parser.add_argument('--page-size', type=int,
+                        help='fetch assignmentsForStudents in pages of PAGE_SIZE rows by cursor (implies --replay)')
+    parser.add_argument('--page-workers', type=int, default=4, help='number of pages of one course fetched at once')
+    parser.add_argument('--no-block', action='store_true',
+                        help='let the browser load images, fonts, stylesheets and telemetry (for debugging the login)')
+    parser.add_argument('--store', help='also load each course into this SQLite store for scraper.py query')
+    parser.add_argument('--warehouse', help='also add each course as a snapshot to this SQLite history warehouse')
+    parser.add_argument('--archive-dir', default='raw',
+                        help='folder where the raw CourseDetail responses are archived for reprocess')
+    parser.add_argument('--no-archive', action='store_true', help='do not archive the raw responses')
+    return parser
+
+
+def build_reprocess_parser():
+    """the command line parser of the reprocess command"""
+    parser = argparse.ArgumentParser(prog='scraper.py reprocess',
+                                     description='rebuild the outputs from archived CourseDetail responses')
+    parser.add_argument('archive', nargs='*', default=['raw'],
+                        help='archive folders and/or archived response files (default: raw)')
+    parser.add_argument('--out-dir', default='.',
+                        help='output folder; each response is written to OUT_DIR/<courseId>/<etlStart>/')
+    parser.add_argument('--latest', action='store_true',
+                        help='only rebuild the newest response of each course, to OUT_DIR/<courseId>/')
+    parser.add_argument('--format', default='csv', choices=output_formats, help='output format')
+    parser.add_argument('--normalize', action='store_true', help='write the normalized tables')
+    parser.add_argument('--compact', action='store_true', help='hold the tables in compact form')
+    parser.add_argument('--summaries', action='store_true', help='also write the summary tables')
+    parser.add_argument('--store', help='also load the newest response of each course into this SQLite store '
+                                        '(for scraper.py query)')
+    parser.add_argument('--warehouse', help='also add every response to this SQLite history warehouse')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes (default: one per CPU)')
+    return parser
+
+
+def option_error(stream=False, fmt='csv', incremental=False, normalize=False, summaries=False, compact=False):
+    """check a combination of output options (shared by the command line and the daemon's jobs)
+        Returns:
+            What is wrong with the options, or None if they can be combined.
+    """
+    if fmt not in output_formats:
+        return 'unknown output format %s' % fmt
+    if stream and fmt != 'csv':
+        return '--stream only writes csv'
+    if stream and (incremental or normalize or summaries or compact):
+        return '--stream cannot be combined with --incremental, --normalize, --summaries or --compact'
+    if normalize and incremental:
+        return '--normalize and --incremental cannot be combined'
+    return None
+
+
+def parse_args(argv=None):
+    """parse and check the command line
+        Returns:
+            A tuple of the parsed arguments and the list of course URLs.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    # get canvas course URL(s) from the command line
+    course_urls = list(args.course_url)  # e.g., ['https://canvas.vt.edu/courses/123456']
+    if args.courses:
+        with open(args.courses) as f:
+            course_urls += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    if not course_urls:
+        parser.error('at least one course URL is required')
+    error = option_error(args.stream, args.format, args.incremental, args.normalize, args.summaries, args.compact)
+    if error:
+        parser.error(error)
+    return args, course_urls
+
+
+def reprocess_payload(path, out_dir, fmt='csv', normalize=False, summaries=False, store_path=None, compact=False):
+    """rebuild the outputs of one archived response (runs in a worker process)
+        Returns:
+            The output folder.
+    """
+    configure_logging()
+    body = load_payload(path)
+    write_course(body, out_dir, fmt=fmt, normalize=normalize, course_url=path, summaries=summaries, compact=compact)
+    if store_path:
+        store.load_course(store_path, body, os.path.getmtime(path))
+    return out_dir
+
+
+def reprocess(argv=None):
+    """rebuild outputs from archived responses, in parallel, without a browser"""
+    args = build_reprocess_parser().parse_args(argv)
+    configure_logging()
+    paths = find_payloads(args.archive)
+    if not paths:
+        logger.error('No archived responses found in %s.' % ', '.join(args.archive))
+        sys.exit(1)
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        info_futures = {path: executor.submit(payload_info, path) for path in paths}
+        infos = {}
+        for path, future in info_futures.items():
+            try:
+                infos[path] = future.result()
+            except Exception as e:  # ooops! e.g., a truncated or corrupt archive
+                failed += 1
+                logger.error('Could not read %s (%s).' % (path, e))
+        paths = list(infos)
+        latest = {}
+        for path, info in infos.items():
+            best = latest.get(info['courseId'])
+            if best is None or (info['etlStart'] or 0) >= (infos[best]['etlStart'] or 0):
+                latest[info['courseId']] = path
+        newest = set(latest.values())
+        jobs = {}
+        if args.latest:
+            for course_id, path in latest.items():
+                jobs[path] = os.path.join(args.out_dir, str(course_id))
+        else:
+            for path, info in infos.items():
+                jobs[path] = os.path.join(args.out_dir, str(info['courseId']), str(info['etlStart']))
+        logger.info('Reprocessing %d archived responses with %d workers...' % (len(jobs), args.jobs))
+        futures = {executor.submit(reprocess_payload, path, out_dir, args.format, args.normalize,
+                                   args.summaries, args.store if path in newest else None, args.compact): path
+                   for path, out_dir in jobs.items()}
+        for future in as_completed(futures):
+            try:
+                logger.info('Rebuilt %s from %s.' % (future.result(), futures[future]))
+            except Exception as e:  # ooops!
+                failed += 1
+                logger.error('Could not reprocess %s (%s).' % (futures[future], e))
+    if args.warehouse:
+        # every archived snapshot, oldest first within each course
+        for path in sorted(paths, key=lambda path: (str(infos[path]['courseId']), infos[path]['etlStart'] or 0)):
+            try:
+                inserted = warehouse.load_snapshot(args.warehouse, load_payload(path), os.path.getmtime(path))
+                if inserted is not None:
+                    logger.info('Added %s to %s (%d new rows).' % (path, args.warehouse, inserted))
+            except Exception as e:  # ooops!
+                failed += 1
+                logger.error('Could not add %s to %s (%s).' % (path, args.warehouse, e))
+    logger.info('Reprocessing complete! (%d failed)' % failed)
+    if failed:
+        sys.exit(1)
+
+
+def build_query_parser():
+    """the command line parser of the query command"""
+    parser = argparse.ArgumentParser(prog='scraper.py query',
+                                     description='look up activity in the local store, without any network traffic')
+    parser.add_argument('--store', default='canvas.db', help='the SQLite store loaded with scraper.py --store')
+    parser.add_argument('--course', help='only this courseId')
+    parser.add_argument('--student', help="a student's Canvas ID, SIS ID, email or name")
+    parser.add_argument('--assignment', help="an assignment's ID or name, e.g., 'HW 1 Work'")
+    parser.add_argument('--section', help="a section's ID or name")
+    parser.add_argument('--sql', help='run this (read-only) SQL query instead')
+    parser.add_argument('--output', default='csv', choices=['csv', 'json'], help='CSV or JSON lines on stdout')
+    return parser
+
+
+def query(argv=None):
+    """answer a student/assignment/section question from the local store"""
+    parser = build_query_parser()
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.store):
+        parser.error('no store at %s (scrape with --store first)' % args.store)
+    if not (args.sql or args.student or args.assignment or args.section or args.course):
+        parser.error('give at least one of --course, --student, --assignment, --section or --sql')
+    import sqlite3
+    try:
+        if args.sql:
+            columns, rows = store.run_sql(args.store, args.sql)
+        else:
+            columns, rows = store.find_activity(args.store, args.course, args.student, args.assignment, args.section)
+    except sqlite3.Error as e:  # e.g., bad SQL, or a write to the read-only store
+        parser.error('query failed: %s' % e)
+    if args.output == 'json':
+        for row in rows:
+            print(json.dumps(dict(zip(columns, row))))
+    else:
+        import csv
+        writer = csv.writer(sys.stdout)
+        writer.writerow(columns)
+        writer.writerows(rows)
+
+
+def configure_logging():
+    """log to scraper.log and the console"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s - %(message)s',
+        handlers=[
+            logging.FileHandler('scraper.log'),
+            logging.StreamHandler()
+        ])
+
 
 #
 # Selenium
 #
-# initialize the Chrome driver
-# NOTE: install a chromedriver version that matches your computer's version of Chrome (https://chromedriver.chromium.org/downloads)
-options = webdriver.ChromeOptions() 
-options.add_experimental_option('excludeSwitches', ['enable-logging']) # to supress the error messages/logs
-options.add_argument("--headless") # headless
-driver = webdriver.Chrome(options=options, executable_path=r'chromedriver.exe')
+# Chrome switches for a lean headless profile: no extensions, sync, updates or background traffic
+lean_chrome_flags = [
+    '--disable-gpu', '--disable-extensions', '--disable-sync', '--disable-default-apps',
+    '--disable-background-networking', '--disable-component-update', '--disable-domain-reliability',
+    '--disable-client-side-phishing-detection', '--disable-features=Translate,OptimizationHints,MediaRouter',
+    '--no-first-run', '--no-default-browser-check', '--mute-audio', '--metrics-recording-only',
+]
+# requests that are not needed to log on and trigger CourseDetail: images (avatars included),
+# fonts, stylesheets, media and third-party telemetry
+blocked_urls = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.ico', '*.webp', '*.bmp',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot', '*.css', '*.mp4', '*.webm', '*.mp3',
+    '*/images/thumbnails/*', '*gravatar.com*',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*', '*sentry.io*',
+    '*nr-data.net*', '*newrelic.com*', '*pendo.io*', '*hotjar.com*', '*segment.io*', '*segment.com*',
+    '*fullstory.com*', '*heapanalytics.com*', '*mixpanel.com*',
+]
+# the same requests as a selenium-wire scope (a query string may follow the file name)
+blocked_scope = '|'.join('^%s(\\?.*)?$' % re.escape(url).replace(r'\*', '.*') for url in blocked_urls)
+
+
+def block_request(request):
+    """abort a request that matches blocked_urls (a selenium-wire request interceptor)
+        Returns:
+            True if the request was blocked.
+    """
+    if re.match(blocked_scope, request.url):
+        request.abort()
+        return True
+    return False
+
+
+def create_driver(block_resources=True):
+    """initialize the Chrome driver
+        Args:
+            block_resources: Block the requests in blocked_urls and skip images, so
+                the pages only load what the login and New Analytics need.
+    """
+    # NOTE: install a chromedriver version that matches your computer's version of Chrome (https://chromedriver.chromium.org/downloads)
+    from seleniumwire import webdriver
+    logging.getLogger('seleniumwire').setLevel(logging.ERROR)
+    options = webdriver.ChromeOptions()
+    options.add_experimental_option('excludeSwitches', ['enable-logging']) # to supress the error messages/logs
+    options.add_argument("--headless") # headless
+    for flag in lean_chrome_flags:
+        options.add_argument(flag)
+    if block_resources:
+        options.add_argument('--blink-settings=imagesEnabled=false')
+        # return from driver.get once the DOM is ready instead of after every image and stylesheet
+        options.page_load_strategy = 'eager'
+    seleniumwire_options = {
+        # keep the (few) captured requests in memory instead of on disk, and cap them
+        'request_storage': 'memory',
+        'request_storage_max_size': 100,
+    }
+    driver = webdriver.Chrome(options=options, seleniumwire_options=seleniumwire_options,
+                              executable_path=r'chromedriver.exe')
+    # only capture (and intercept) the analytics GraphQL endpoint; scripts and
+    # the login pages pass through the proxy without being recorded
+    driver.scopes = [graphql_scope]
+    driver.block_resources = block_resources
+    if block_resources:
+        # blocked in the browser for the Canvas pages, so they never reach the proxy either
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': blocked_urls})
+        # but New Analytics is a cross-site iframe, which Chrome runs as a separate target
+        # that setBlockedURLs does not reach; the proxy aborts its requests instead
+        driver.scopes = [graphql_scope, blocked_scope]
+        driver.request_interceptor = block_request
+    return driver
+
+
+def login(driver, course_url, username, password, cookies=None, metrics=None):
+    """log on to a Canvas course page and open the New Analytics tool
+        Args:
+            driver: The selenium-wire driver.
+            course_url: The Canvas course URL.
+            username: Canvas username.
+            password: Canvas password.
+            cookies: Cookies saved from an earlier session; if they are still
+                valid the username/password and 2FA steps are skipped.
+            metrics: Records the page_load and login_2fa stages, if given.
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    logger.info('Logging on to %s...'%course_url)
+    if cookies:
+        # replay the saved Canvas cookies before the first page load; CDP accepts
+        # cookies for any domain, unlike driver.add_cookie
+        for cookie in cookies:
+            cookie = dict(cookie)
+            if 'expiry' in cookie:
+                cookie['expires'] = cookie.pop('expiry')
+            driver.execute_cdp_cmd('Network.setCookie', cookie)
+    with stage(metrics, 'page_load', course=course_url):
+        driver.get(course_url)  # go to course URL
+    with stage(metrics, 'login_2fa', course=course_url):
+        if driver.find_elements(By.ID, 'username'):
+            driver.find_element(By.ID, 'username').send_keys(
+                username)  # enter username
+            driver.find_element(By.ID, 'password').send_keys(
+                password)  # enter password
+            # click login button
+            driver.find_element(By.NAME, '_eventId_proceed').click()
+            # two-factor authentication (2FA)
+            # switch to 2FA page iframe
+            driver.switch_to.frame(driver.find_element(
+                By.XPATH, "//iframe[@id='duo_iframe']"))
+            # click Send Me a Push button
+            driver.find_element(
+                By.XPATH, "//button[contains(text(), 'Send Me a Push')]").click()
+            logger.info('Waiting for 2-Factor Authentication...')
+        else:
+            logger.info('Reusing cached Canvas cookies...')
+
+        # wait for 2FA to log us on, then click New Analytics from the left menu
+        WebDriverWait(driver, 60).until(EC.element_to_be_clickable(
+            (By.XPATH, "//a[contains(text(),'New Analytics')]"))).click()
+    logger.info('Authenticated!')
+
+
+#
+# session cache
+#
+def load_session_cache(path):
+    """load the session cache, or an empty one if it is missing or unreadable"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'cookies': [], 'courses': {}}
+
+
+def save_session_cache(path, cache):
+    """save the session cache, readable by the current user only, replacing the old one atomically
+        The daemon, watch and cron runs may share the cache, so a reader never sees a partial file.
+    """
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, path)
+
+
+def fresh_cookies(cache, now=None):
+    """return the cached cookies, or None if any of them has expired"""
+    now = time.time() if now is None else now
+    cookies = cache.get('cookies') or None
+    if cookies and any(c.get('expiry', now + 1) <= now for c in cookies):
+        return None
+    return cookies
+
+
+def cached_analytics_session(cache, course_url, max_age, now=None):
+    """return the cached analytics session for a course, or None if it is missing or stale"""
+    now = time.time() if now is None else now
+    analytics_session = cache.get('courses', {}).get(course_url)
+    if analytics_session and now - analytics_session.get('saved_at', 0) < max_age:
+        return analytics_session
+    return None
+
+
+#
+# analytics GraphQL replay
+#
+# headers that belong to the browser's connection and must not be replayed
+hop_by_hop_headers = ['host', 'content-length', 'connection', 'accept-encoding']
+# URL scope of the analytics GraphQL endpoint
+graphql_scope = r'.*graphql$'
+
+
+class GraphQLError(Exception):
+    """the analytics GraphQL endpoint rejected a query"""
+
+
+def query_refused(error):
+    """whether an error means the endpoint cannot run a query, rather than that the session expired
+        GraphQL servers refuse a query they do not understand either with errors in an HTTP 200
+        response or with HTTP 400; only 401 and 403 mean the session is no longer valid.
+    """
+    response = getattr(error, 'response', None)
+    if response is not None:  # a requests.HTTPError
+        return 400 <= response.status_code < 500 and response.status_code not in (401, 403)
+    return isinstance(error, (GraphQLError, ValueError))
 
-datetime_headers = ['lastParticipationTime', 'lastPageviewTime', 'lastLoggedOut', 'dueDate', '.date']
-def reformat(name, x):
-    """apply any special value re-formatting"""
 
-    # change datetime fields to Y-m-d H:M:S
-    if re.search(r'|'.join(datetime_headers), name) and isinstance(x, int):
-        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(x/1000.0))
+class GraphQLCapture:
+    """selenium-wire interceptors that signal as soon as a GraphQL operation is seen
+        Install with install(driver); request_seen is set when the browser sends
+        the operation and response_seen when its response completes.
+    """
+
+    def __init__(self, operation_name):
+        self.operation_name = operation_name
+        self.block = False
+        self.request = None
+        self.response_body = None
+        self.request_seen = threading.Event()
+        self.response_seen = threading.Event()
+
+    def install(self, driver):
+        """attach the interceptors to a driver, keeping its resource blocking"""
+        self.block = getattr(driver, 'block_resources', False)
+        driver.request_interceptor = self.intercept_request
+        driver.response_interceptor = self.intercept_response
+
+    def uninstall(self, driver):
+        """detach the interceptors and drop the capture buffer"""
+        del driver.request_interceptor
+        del driver.response_interceptor
+        del driver.requests
+        if self.block:
+            driver.request_interceptor = block_request
+
+    def matches(self, request):
+        """is this request the operation we are waiting for?"""
+        if not request.body or not re.search(r'graphql$', request.url):
+            return False
+        from seleniumwire.utils import decode
+        body = decode(request.body, request.headers.get('Content-Encoding', 'identity'))
+        if self.operation_name.encode() not in body:  # cheap test before parsing
+            return False
+        try:
+            return json.loads(body).get('operationName') == self.operation_name
+        except ValueError:  # batched or malformed query
+            return False
 
-    return x
+    def intercept_request(self, request):
+        """remember the first matching request"""
+        if self.block and block_request(request):
+            return
+        if not self.request_seen.is_set() and self.matches(request):
+            self.request = request
+            self.request_seen.set()
 
-def flatten_json(nested_json, exclude=['']):
-    """Flatten json object with nested keys into a single level.
+    def intercept_response(self, request, response):
+        """decode the first matching response"""
+        if not self.response_seen.is_set() and self.matches(request):
+            from seleniumwire.utils import decode
+            self.response_body = decode(response.body, response.headers.get(
+                'Content-Encoding', 'identity'))
+            self.response_seen.set()
+
+
+def get_analytics_session(request):
+    """extract the analytics session from a captured GraphQL request
         Args:
-            nested_json: A nested json object.
-            exclude: Keys to exclude from output.
+            request: A captured selenium-wire request to the analytics GraphQL endpoint.
         Returns:
-            The flattened json object if successful, None otherwise.
-        #
-        # the original version of this function is from
-        # https://stackoverflow.com/questions/52795561/flattening-nested-json-in-pandas-data-frame
-        #            
+            A dict holding the endpoint URL, session-id, contextId, tcGuid, the
+            headers to replay and the query text keyed by operationName.
     """
-    out = {}
-
-    # recursively flatten JSON
-    def flatten(x, name='', exclude=exclude):
-        if type(x) is dict:
-            for a in x:
-                if a not in exclude:
-                    flatten(x[a], name + a + '.')
-        elif type(x) is list:
-            i = 0
-            for a in x:
-                flatten(a, name + str(i) + '.')
-                i += 1
+    from seleniumwire.utils import decode
+    json_request = json.loads(decode(request.body, request.headers.get(
+        'Content-Encoding', 'identity')))
+    return {
+        'graphql_url': request.url,
+        'session_id': request.headers.get('session-id'),
+        'context_id': json_request['variables']['contextId'],
+        'tc_guid': json_request['variables']['tcGuid'],
+        'headers': {k: v for k, v in request.headers.items() if k.lower() not in hop_by_hop_headers},
+        'queries': {json_request['operationName']: json_request['query']},
+    }
+
+
+def create_http_session(pool_size=10):
+    """create a keep-alive HTTP session with a connection pool"""
+    import requests
+    from requests.adapters import HTTPAdapter
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    http.mount('https://', adapter)
+    http.mount('http://', adapter)
+    return http
+
+
+def graphql_request(http, analytics_session, operation_name, variables=None, query=None, timeout=60):
+    """send a GraphQL operation directly to the analytics endpoint
+        Args:
+            http: A requests session (see create_http_session).
+            analytics_session: The session returned by get_analytics_session.
+            operation_name: The GraphQL operationName, e.g., CourseDetail.
+            variables: Extra variables; contextId and tcGuid are always sent.
+            query: The query text; defaults to the text captured for operation_name.
+            timeout: Request timeout in seconds.
+        Returns:
+            The raw (decoded) response body.
+    """
+    if query is None:
+        query = analytics_session['queries'][operation_name]
+    payload = {
+        'operationName': operation_name,
+        'variables': dict({'contextId': analytics_session['context_id'],
+                           'tcGuid': analytics_session['tc_guid']}, **(variables or {})),
+        'query': query,
+    }
+    response = http.post(analytics_session['graphql_url'],
+                         headers=analytics_session['headers'], json=payload, timeout=timeout)
+    response.raise_for_status()
+    body = response.content
+    # only parse the body here when it may hold errors
+    if b'"errors"' in body:
+        json_response = json.loads(body)
+        if json_response.get('errors'):
+            raise GraphQLError('%s failed: %s' % (operation_name, json_response['errors']))
+    return body
+
+
+def graphql_query(http, analytics_session, operation_name, variables=None, query=None, timeout=60):
+    """send a GraphQL operation directly to the analytics endpoint and decode the JSON response
+        See graphql_request for the arguments.
+    """
+    return json.loads(graphql_request(http, analytics_session, operation_name, variables, query, timeout))
+
+
+def fetch_course_detail(http, analytics_session, page_size=None, page_workers=4):
+    """fetch CourseDetail directly, optionally paging assignmentsForStudents by cursor
+        Args:
+            http: A requests session (see create_http_session).
+            analytics_session: The session returned by get_analytics_session.
+            page_size: Rows of assignmentsForStudents per page; None for one request.
+            page_workers: The most pages fetched at once.
+        Returns:
+            The raw CourseDetail response body; paged responses are merged into
+            the same layout as an unpaged one.
+    """
+    if not page_size:
+        return graphql_request(http, analytics_session, 'CourseDetail')
+    import requests
+    query = analytics_session['queries']['CourseDetail']
+    try:
+        head = graphql_query(http, analytics_session, 'CourseDetail', {'first': page_size}, head_query(query))
+    except (GraphQLError, ValueError, requests.HTTPError) as e:
+        if not query_refused(e):
+            raise
+        # the endpoint does not take first/after, or the captured query could not be paged
+        logger.info('Paged CourseDetail refused (%s), fetching it in one request.' % e)
+        return graphql_request(http, analytics_session, 'CourseDetail')
+    course = head['data']['course']
+    first_page = course[paged_field]
+    cursors = predicted_cursors(course, page_size)
+    pages_query = page_query(query)
+
+    def fetch_page(after):
+        return graphql_query(http, analytics_session, 'CourseDetailPage', {'first': page_size, 'after': after},
+                             pages_query)['data']['course'][paged_field]
+
+    def pages():
+        yield first_page
+        last = first_page[-1]['cursor'] if len(first_page) == page_size else None
+        if last is not None and cursors and cursors[0] == last:
+            # the predicted pages, at most page_workers in flight and merged in order
+            with ThreadPoolExecutor(max_workers=page_workers) as executor:
+                predicted = iter(cursors)
+                window = deque((after, executor.submit(fetch_page, after))
+                               for after in islice(predicted, page_workers))
+                while window and last is not None:
+                    after, future = window.popleft()
+                    if after != last:  # the prediction broke, e.g., a student lacks a row
+                        break
+                    rows = future.result()
+                    yield rows
+                    last = rows[-1]['cursor'] if len(rows) == page_size else None
+                    window.extend((after, executor.submit(fetch_page, after)) for after in islice(predicted, 1))
+                for _, future in window:
+                    future.cancel()
+        # follow the cursors one page at a time past (or instead of) the prediction
+        while last is not None:
+            rows = fetch_page(last)
+            yield rows
+            last = rows[-1]['cursor'] if len(rows) == page_size else None
+
+    return merged_body(course, pages())
+
+
+def capture_course_detail(driver, course_url, username, password, cookies=None, replay=False, metrics=None,
+                          page_size=None, page_workers=4):
+    """log on to a course, open New Analytics and capture the CourseDetail response
+        Args:
+            driver: The selenium-wire driver.
+            course_url: The Canvas course URL.
+            username: Canvas username.
+            password: Canvas password.
+            cookies: Cookies from an authenticated session (skips the login and 2FA).
+            replay: Replay CourseDetail over HTTP instead of waiting for the page's response.
+            metrics: Records the browser and capture stages, if given.
+            page_size: Page the replayed CourseDetail (see fetch_course_detail).
+            page_workers: The most pages fetched at once.
+        Returns:
+            A tuple of the raw CourseDetail response body and the analytics session.
+    """
+    capture = GraphQLCapture('CourseDetail')
+    capture.install(driver)
+    try:
+        login(driver, course_url, username, password, cookies, metrics)
+
+        # wait for the CourseDetail graphql request
+        # see additional notes at the bottom of this script
+        with stage(metrics, 'capture_request', course=course_url):
+            if not capture.request_seen.wait(60):
+                raise TimeoutError('GraphQL CourseDetail request not found.')
+            analytics_session = get_analytics_session(capture.request)
+        if replay:
+            # replay CourseDetail over HTTP rather than waiting for the page to render it
+            with stage(metrics, 'replay', course=course_url) as record:
+                body = fetch_course_detail(create_http_session(page_workers), analytics_session,
+                                           page_size, page_workers)
+                record['bytes'] = len(body)
+            return body, analytics_session
+
+        # wait for the page's own CourseDetail response
+        with stage(metrics, 'capture_response', course=course_url) as record:
+            if not capture.response_seen.wait(60):
+                raise TimeoutError('GraphQL CourseDetail response not found.')
+            record['bytes'] = len(capture.response_body)
+        return capture.response_body, analytics_session
+    finally:
+        capture.uninstall(driver)
+
+
+def capture_courses(course_urls, username, password, cookies=None, replay=False, workers=4, metrics=None,
+                    page_size=None, page_workers=4, block_resources=True):
+    """capture CourseDetail for many courses over one authenticated browser session
+        The first course is captured with an interactive login (one 2FA push);
+        the remaining courses are spread over a pool of browsers seeded with
+        the resulting cookies.
+        Args:
+            course_urls: The Canvas course URLs.
+            username: Canvas username.
+            password: Canvas password.
+            cookies: Cookies from an earlier session, if any.
+            replay: See capture_course_detail.
+            workers: The maximum number of browsers.
+            metrics: Records the browser and capture stages, if given.
+            page_size: See capture_course_detail.
+            page_workers: See capture_course_detail.
+            block_resources: See create_driver.
+        Returns:
+            A tuple of a dict of course URL to (response body, analytics_session)
+            or the exception raised for that course, and the session cookies.
+    """
+    results = {}
+    with stage(metrics, 'browser_start'):
+        driver = create_driver(block_resources)
+    try:
+        # authenticate once
+        try:
+            results[course_urls[0]] = capture_course_detail(
+                driver, course_urls[0], username, password, cookies, replay, metrics, page_size, page_workers)
+        except Exception as e:  # ooops!
+            # without a session every other course would trigger its own 2FA push
+            return {course_url: e for course_url in course_urls}, cookies
+        cookies = driver.get_cookies()
+
+        # fan the remaining courses out over the pool
+        pending = queue.Queue()
+        for course_url in course_urls[1:]:
+            pending.put(course_url)
+
+        def worker(driver):
+            try:
+                while True:
+                    try:
+                        course_url = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    logger.info('Scraping %s...' % course_url)
+                    try:
+                        results[course_url] = capture_course_detail(
+                            driver, course_url, username, password, cookies, replay, metrics,
+                            page_size, page_workers)
+                    except Exception as e:  # ooops!
+                        results[course_url] = e
+            finally:
+                driver.quit()
+
+        threads = []
+        for i in range(min(workers, pending.qsize())):
+            # the logged-in driver joins the pool; the others start fresh
+            if i == 0:
+                pool_driver, driver = driver, None  # now owned by the first worker
+            else:
+                try:
+                    pool_driver = create_driver(block_resources)
+                except Exception as e:  # ooops!
+                    logger.error('Could not start another browser (%s), scraping with %d.' % (e, len(threads)))
+                    break
+            thread = threading.Thread(target=worker, args=(pool_driver,))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+    finally:
+        if driver is not None:
+            driver.quit()
+    return results, cookies
+
+
+def fetch_cached_course_detail(http, cache, course_url, max_age, metrics=None, page_size=None, page_workers=4):
+    """fetch CourseDetail with a cached analytics session, or return None if there is no usable session"""
+    analytics_session = cached_analytics_session(cache, course_url, max_age)
+    if not analytics_session:
+        return None
+    import requests
+    logger.info('Reusing cached analytics session for %s...' % course_url)
+    try:
+        with stage(metrics, 'replay', course=course_url) as record:
+            body = fetch_course_detail(http, analytics_session, page_size, page_workers)
+            record['bytes'] = len(body)
+        return body
+    except (requests.RequestException, GraphQLError) as e:  # expired or revoked
+        logger.info('Cached analytics session for %s is stale (%s).' % (course_url, e))
+        return None
+
+
+def transform_course(body, normalize=False, metrics=None, profile=None, course_url=None, compact=False):
+    """decode a CourseDetail response and build its tables; needs no browser
+        Args:
+            body: The raw CourseDetail response body.
+            normalize: Build the normalized tables (see transform.normalized_frames).
+            metrics: Records the decode, flatten/normalize and dataframe stages, if given.
+            profile: A cProfile.Profile enabled around the transform stages, if given.
+            course_url: The course, to label the metrics with.
+            compact: Build compact tables (see transform.compact_frame).
+        Returns:
+            A dict of table name to DataFrame.
+    """
+    if metrics is not None and 'pandas' not in sys.modules:
+        # pandas (and numpy) are imported lazily; time that on its own rather than in the first course's stages
+        with stage(metrics, 'import', course=course_url):
+            importlib.import_module('pandas')
+    with stage(metrics, 'decode', course=course_url) as record:
+        json_response = json.loads(body)
+        record['bytes'] = len(body)
+    # extract list of students, list of assignments, and student assignment activity
+    if profile is not None:
+        profile.enable()
+    try:
+        if normalize:
+            with stage(metrics, 'normalize', course=course_url) as record:
+                frames = normalized_frames(json_response, compact)
+                record['rows'] = sum(len(frame) for frame in frames.values())
         else:
-            out[name[:-1]] = reformat(name[:-1], x)
+            with stage(metrics, 'flatten', course=course_url) as record:
+                rows = course_rows(json_response, compact)
+                record['rows'] = sum(len(table_rows) for table_rows in rows.values())
+            with stage(metrics, 'dataframe', course=course_url) as record:
+                frames = rows_frames(rows, compact)
+    finally:
+        if profile is not None:
+            profile.disable()
+    if metrics is not None:
+        # memory report: what the tables hold on to once the response and rows are gone
+        memory = frames_memory(frames)
+        record['memory_bytes'] = sum(memory.values())
+        logger.info('The tables take %.1f MiB in memory (%s).' % (record['memory_bytes'] / 2**20, ', '.join(
+            '%s %.1f MiB' % (table, size / 2**20) for table, size in memory.items())))
+    return frames
 
-    flatten(nested_json)
-    return out
 
+def write_course(body, out_dir, stream=False, fmt='csv', incremental=False, normalize=False,
+                 metrics=None, profile=None, course_url=None, summaries=False, compact=False):
+    """flatten a CourseDetail response and write the student, assignment and activity files
+        Args:
+            body: The raw CourseDetail response body.
+            out_dir: The output folder.
+            stream: Parse incrementally and write the CSV files in chunks.
+            fmt: One of output_formats.
+            incremental: Compare with the last snapshot written to out_dir (see
+                delta.py); write nothing if the course's updatedAt/etlStart
+                watermark has not moved, otherwise write only delta files.
+            normalize: Write the normalized tables (see transform.normalized_frames).
+            metrics: Records the decode, flatten, dataframe and write stages, if given.
+            profile: A cProfile.Profile enabled around the transform stages, if given.
+            course_url: The course, to label the metrics with.
+            summaries: Also write the student, section and assignment summaries
+                (see analytics.py), always in full.
+            compact: Build compact tables (see transform.compact_frame); the
+                files written are the same.
+    """
+    if stream:
+        logger.info('Streaming student, assignment and activity data to %s...' % out_dir)
+        with stage(metrics, 'stream_write', course=course_url) as record:
+            counts = write_course_csv_stream(io.BytesIO(body), out_dir)
+            record['rows'], record['bytes'] = sum(counts.values()), len(body)
+        logger.info('Wrote %(students)d students, %(assignments)d assignments and '
+                    '%(student_assignment_activity)d activity rows.' % counts)
+        return
+
+    state = None
+    if incremental:
+        state = load_state(out_dir)
+        watermark = course_watermark(body)
+        if state and state['watermark'] == watermark:
+            logger.info('Course unchanged since the last run (updatedAt=%s, etlStart=%s), skipping.' % tuple(watermark))
+            return
+
+    frames = transform_course(body, normalize, metrics, profile, course_url, compact)
+
+    os.makedirs(out_dir, exist_ok=True)
+    if state:
+        # write what changed since the last snapshot
+        hashes = {}
+        for table, frame in frames.items():
+            with stage(metrics, 'write_delta', course=course_url, table=table) as record:
+                delta, hashes[table] = diff_table(frame, table, state['hashes'].get(table, {}))
+                logger.info('Writing %d changed %s rows to %s_delta_%s.%s...' % (
+                    len(delta), table, table, watermark[1], fmt))
+                path = write_table(delta, out_dir, '%s_delta_%s' % (table, watermark[1]), fmt)
+                record['rows'], record['bytes'] = len(delta), os.path.getsize(path)
+        save_state(out_dir, {'watermark': watermark, 'hashes': hashes})
+    else:
+        # write to file
+        for table, frame in frames.items():
+            logger.info('Writing %d rows to %s.%s...' % (len(frame), table, fmt))
+            with stage(metrics, 'write', course=course_url, table=table) as record:
+                path = write_table(frame, out_dir, table, fmt)
+                record['rows'], record['bytes'] = len(frame), os.path.getsize(path)
+        if incremental:
+            save_state(out_dir, {'watermark': watermark, 'hashes': {
+                table: dict(zip(*row_hashes(frame, table))) for table, frame in frames.items()}})
+
+    # the summaries come last, so the tables above are written even if they fail
+    if summaries:
+        with stage(metrics, 'analytics', course=course_url) as record:
+            summary = summary_frames(frames)
+            record['rows'] = sum(len(frame) for frame in summary.values())
+        for table, frame in summary.items():
+            logger.info('Writing %d rows to %s.%s...' % (len(frame), table, fmt))
+            write_table(frame, out_dir, table, fmt)
+
+
+def fetch_courses(course_urls, username, password, session_cache=None, max_session_age=8*60*60,
+                  replay=False, workers=4, metrics=None, page_size=None, page_workers=4, block_resources=True):
+    """get the CourseDetail response of every course, logging on only if a cached session will not do
+        The browser is started only for the courses without a usable cached
+        analytics session.
+        Args:
+            course_urls: The Canvas course URLs.
+            username: Canvas username.
+            password: Canvas password.
+            session_cache: File used to save and reuse cookies and analytics
+                sessions between runs; None to always log on and save nothing.
+            max_session_age: Seconds before a cached analytics session is considered stale.
+            replay: Fetch CourseDetail over HTTP once New Analytics is open.
+            workers: Number of browsers (and HTTP connections) used in parallel.
+            metrics: Records the stages, if given.
+            page_size: Rows of assignmentsForStudents per page when CourseDetail is
+                fetched over HTTP; None for one request per course.
+            page_workers: The most pages of one course fetched at once.
+            block_resources: See create_driver.
+        Returns:
+            A dict of course URL to raw CourseDetail response body; courses that
+            could not be scraped are left out.
+    """
+    cache = load_session_cache(session_cache) if session_cache else {'cookies': [], 'courses': {}}
+    responses = {}
 
-def main():
-    """ the main function """
     #
-    # 1. Log on to Canvas course page
+    # 1. Try the cached analytics sessions first, all courses at once
     #
-    logger.info('Logging on to %s...'%course_url)
-    driver.get(course_url)  # go to course URL
-    driver.find_element(By.ID, 'username').send_keys(
-        username)  # enter username
-    driver.find_element(By.ID, 'password').send_keys(
-        password)  # enter password
-    # click login button
-    driver.find_element(By.NAME, '_eventId_proceed').click()
-    # two-factor authentication (2FA)
-    # switch to 2FA page iframe
-    driver.switch_to.frame(driver.find_element(
-        By.XPATH, "//iframe[@id='duo_iframe']"))
-    # click Send Me a Push button
-    driver.find_element(
-        By.XPATH, "//button[contains(text(), 'Send Me a Push')]").click()
+    http = create_http_session(workers * page_workers if page_size else workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        cached = executor.map(lambda course_url: fetch_cached_course_detail(
+            http, cache, course_url, max_session_age, metrics, page_size, page_workers), course_urls)
+        for course_url, body in zip(course_urls, cached):
+            if body is not None:
+                responses[course_url] = body
+            else:
+                cache.get('courses', {}).pop(course_url, None)
 
     #
-    # 2. Go to Canvas New Analytics tool
+    # 2. Log on to Canvas once, then open New Analytics for the remaining courses
     #
-    # wait for 2FA to log us on, then click New Analytics from the left menu
-    logger.info('Waiting for 2-Factor Authentication...')
-    WebDriverWait(driver, 60).until(EC.element_to_be_clickable(
-        (By.XPATH, "//a[contains(text(),'New Analytics')]"))).click()
-    logger.info('Authenticated!')
+    remaining = [course_url for course_url in course_urls if course_url not in responses]
+    if remaining:
+        logger.info('Scraping student and assignment data...')
+        results, cookies = capture_courses(remaining, username, password, fresh_cookies(cache),
+                                           replay, workers, metrics, page_size, page_workers, block_resources)
+        cache['cookies'] = cookies
+        for course_url in remaining:
+            result = results.get(course_url)
+            if not isinstance(result, tuple):  # did we get the info we needed?
+                logger.error('GraphQL CourseDetail response not found for %s (%s).' % (course_url, result))
+                continue
+            body, analytics_session = result
+            responses[course_url] = body
+            # remember the session for the next run
+            analytics_session['saved_at'] = time.time()
+            cache.setdefault('courses', {})[course_url] = analytics_session
+        if session_cache:
+            save_session_cache(session_cache, cache)
+    return responses
+
+
+def main(argv=None):
+    """ the main function """
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in commands:
+        return commands[argv[0]](argv[1:])
+    args, course_urls = parse_args(argv)
+    configure_logging()
+    metrics = Metrics(args.trace_memory) if args.metrics_dir or args.trace_memory else None
+    profile = None
+    if args.profile_transform:
+        import cProfile
+        profile = cProfile.Profile()
+
     #
-    # 3. Get student and assignment data
+    # 1-2. Reuse cached sessions, log on for the rest
     #
-    # see additional notes at the bottom of this script
+    responses = fetch_courses(course_urls, args.username, args.password,
+                              None if args.no_session_cache else args.session_cache,
+                              args.max_session_age, args.replay or bool(args.page_size), args.workers, metrics,
+                              args.page_size, args.page_workers, not args.no_block)
 
-    # find the CourseDetail graphql request
-    logger.info('Scraping student and assignment data...')
-    got_filter_query = False
-    for request in driver.requests:
-        if re.search(r'graphql$', request.url) and request.response:
+    if not responses:
+        sys.exit()
+    if not args.no_archive:
+        # keep the raw responses, so the outputs can be rebuilt without logging on again
+        for course_url, body in responses.items():
+            with stage(metrics, 'archive', course=course_url) as record:
+                path = save_payload(body, args.archive_dir, course_url, metrics.run_id if metrics else None)
+                record['bytes'] = os.path.getsize(path)
+            logger.info('Archived the %s response to %s.' % (course_url, path))
+
+    #
+    # 3. Write student and assignment data
+    #
+    for course_url in course_urls:
+        if course_url not in responses:
+            continue
+        body = responses[course_url]
+        try:
+            if len(course_urls) == 1:
+                out_dir = args.out_dir or '.'
+            else:
+                out_dir = os.path.join(args.out_dir or '.', str(course_field(io.BytesIO(body), 'courseId')))
+            write_course(body, out_dir, args.stream, args.format, args.incremental, args.normalize,
+                         metrics, profile, course_url, args.summaries, args.compact)
+        except Exception as e:  # ooops!
+            logger.error('Could not write %s (%s).' % (course_url, e))
+        if args.store:
             try:
-                json_request = json.loads(decode(request.body, request.headers.get(
-                    'Content-Encoding', 'identity')))  # get the request
-                # is it a CourseDetail query?
-                if json_request['operationName'] == 'CourseDetail':
-                    json_response = json.loads(decode(request.response.body, request.response.headers.get(
-                        'Content-Encoding', 'identity')))  # get the response
-                    got_filter_query = True
-                    break
+                with stage(metrics, 'store', course=course_url) as record:
+                    record['rows'] = store.load_course(args.store, body, time.time())
+                logger.info('Loaded %d rows into %s.' % (record['rows'], args.store))
             except Exception as e:  # ooops!
-                logger.error('Invalid GraphQL JSON response (%s).' % e)
-                sys.exit()
-
-    # did we get the info we needed?
-    if not got_filter_query:
-        logger.error('GraphQL CourseDetail request not found.' % e)
-        sys.exit()
+                logger.error('Could not load %s into %s (%s).' % (course_url, args.store, e))
+        if args.warehouse:
+            try:
+                with stage(metrics, 'warehouse', course=course_url) as record:
+                    record['rows'] = warehouse.load_snapshot(args.warehouse, body, time.time())
+                if record['rows'] is None:
+                    logger.info('Snapshot of %s already in %s.' % (course_url, args.warehouse))
+                else:
+                    logger.info('Added a snapshot of %s to %s (%d new rows).' % (course_url, args.warehouse,
+                                                                                  record['rows']))
+            except Exception as e:  # ooops!
+                logger.error('Could not add %s to %s (%s).' % (course_url, args.warehouse, e))
 
-    exclude = ['__typename', 'missing', 'avatarURL', 'cursor']
-    # extract list of students, list of assignments, and student assignment activity
-    students = pd.DataFrame([flatten_json(
-        x, exclude) for x in json_response['data']['course']['studentInCourseConnection']['edges']])
-    assignments = pd.DataFrame([flatten_json(
-        x, exclude) for x in json_response['data']['course']['assignmentForCourseConnection']['edges']])
-    student_assignment_activity = pd.DataFrame([flatten_json(
-        x, exclude) for x in json_response['data']['course']['assignmentsForStudents']])
-    #course = json_response['data']['course']
-
-    # write to .csv file
-    logger.info('Writing student data to students.csv...')
-    students.to_csv('students.csv')
-    logger.info('Writing assignment data to assignments.csv...')    
-    assignments.to_csv('assignments.csv')
-    logger.info('Writing student assignment activity to student_assignment_activity.csv...')        
-    student_assignment_activity.to_csv('student_assignment_activity.csv')
-
-    # close Chrome
-    driver.quit()
+    #
+    # 4. Save the run's metrics
+    #
+    if profile is not None:
+        profile.dump_stats(args.profile_transform)
+        logger.info('Saved the transform profile to %s.' % args.profile_transform)
+    if metrics is not None:
+        for record in metrics.stages:
+            logger.info('%(stage)s: %(seconds).3f s' % record + (
+                ', peak RSS %(peak_rss_bytes)d bytes' % record if record['peak_rss_bytes'] is not None else ''))
+        if args.metrics_dir:
+            os.makedirs(args.metrics_dir, exist_ok=True)
+            metrics.write_json(os.path.join(args.metrics_dir, 'metrics_%s.json' % metrics.run_id))
+            metrics.write_prometheus(os.path.join(args.metrics_dir, 'scraper.prom'))
 
     logger.info('Scraping complete!')
 
 
+def daemon(argv=None):
+    """run the warm browser daemon (see daemon.py)"""
+    from daemon import daemon
+    daemon(argv)
+
+
+def submit(argv=None):
+    """send scrape jobs to the daemon (see daemon.py)"""
+    from daemon import submit
+    submit(argv)
+
+
+def watch(argv=None):
+    """poll courses on a schedule and scrape the ones that changed (see watch.py)"""
+    from watch import watch
+    watch(argv)
+
+
+# the commands besides the default scrape, e.g., python scraper.py reprocess raw
+commands = {'reprocess': reprocess, 'daemon': daemon, 'submit': submit, 'watch': watch, 'query': query}
+
 if __name__ == '__main__':
     main()
 
@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+
+"""
+DESCRIPTION: Indexed local SQLite store of the latest scrape of each course, for answering
+    student, assignment and section questions offline (see scraper.py query).
+    Each load replaces the course's rows. Lookups by student (ID, SIS ID, email or name),
+    assignment (ID or name) and section (ID or name) use indexes, so they take milliseconds.
+INPUT(S):
+    - Raw (decoded) CourseDetail response bodies
+"""
+
+import json
+import sqlite3
+
+from transform import reformat
+
+schema = """
+CREATE TABLE IF NOT EXISTS courses (
+    courseId TEXT PRIMARY KEY, name TEXT, contextId TEXT, etlStart INTEGER, updatedAt INTEGER, loadedAt REAL);
+CREATE TABLE IF NOT EXISTS students (
+    courseId TEXT, studentId TEXT, canvasId TEXT, name TEXT, sortableName TEXT, email TEXT, sisId TEXT,
+    currentOverallScore REAL, onTimePercentage REAL, lastParticipationTime TEXT, lastPageviewTime TEXT,
+    PRIMARY KEY (courseId, studentId));
+CREATE INDEX IF NOT EXISTS students_sis_id ON students (sisId);
+CREATE INDEX IF NOT EXISTS students_email ON students (email COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS students_name ON students (sortableName COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS student_sections (
+    courseId TEXT, studentId TEXT, sectionId TEXT, sectionName TEXT, PRIMARY KEY (courseId, studentId, sectionId));
+CREATE INDEX IF NOT EXISTS student_sections_section ON student_sections (sectionId);
+CREATE INDEX IF NOT EXISTS student_sections_name ON student_sections (sectionName COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS assignments (
+    courseId TEXT, assignmentId TEXT, name TEXT, dueDate TEXT, maxScoreRaw REAL, gradingType TEXT,
+    assignmentType TEXT, PRIMARY KEY (courseId, assignmentId));
+CREATE INDEX IF NOT EXISTS assignments_name ON assignments (name COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS activity (
+    courseId TEXT, assignmentId TEXT, studentId TEXT, assignmentName TEXT, dueDate TEXT,
+    excused INTEGER, late INTEGER, missing INTEGER, PRIMARY KEY (courseId, assignmentId, studentId));
+CREATE INDEX IF NOT EXISTS activity_student ON activity (studentId, courseId);
+CREATE INDEX IF NOT EXISTS activity_assignment ON activity (assignmentId);
+CREATE INDEX IF NOT EXISTS activity_assignment_name ON activity (assignmentName COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS submissions (
+    courseId TEXT, assignmentId TEXT, studentId TEXT, position INTEGER, date TEXT, gradeRaw TEXT,
+    scoreRaw REAL, percentage REAL, PRIMARY KEY (courseId, assignmentId, studentId, position));
+CREATE INDEX IF NOT EXISTS submissions_student ON submissions (studentId);
+"""
+# the tables that hold a course's rows, in load order
+course_tables = ['courses', 'students', 'student_sections', 'assignments', 'activity', 'submissions']
+
+# the query command's lookups: the activity of the selected rows, with the student,
+# the section(s) and the current submission
+activity_query = """
+SELECT a.courseId, a.assignmentId, a.assignmentName, a.dueDate, a.studentId, s.sisId, s.sortableName, s.email,
+       (SELECT group_concat(ss.sectionName, '; ') FROM student_sections ss
+        WHERE ss.courseId = a.courseId AND ss.studentId = a.studentId) AS sections,
+       a.excused, a.late, a.missing, b.date AS submittedAt, b.gradeRaw, b.scoreRaw, b.percentage
+FROM activity a
+JOIN students s ON s.courseId = a.courseId AND s.studentId = a.studentId
+LEFT JOIN submissions b ON b.courseId = a.courseId AND b.assignmentId = a.assignmentId
+    AND b.studentId = a.studentId AND b.position = 0
+"""
+# filters on the activity rows, by what the argument may be
+student_filter = """a.studentId IN (SELECT studentId FROM students WHERE studentId = :student OR canvasId = :student
+    OR sisId = :student OR email = :student COLLATE NOCASE OR sortableName = :student COLLATE NOCASE
+    OR name = :student COLLATE NOCASE)"""
+assignment_filter = "(a.assignmentId = :assignment OR a.assignmentName = :assignment COLLATE NOCASE)"
+section_filter = """a.studentId IN (SELECT studentId FROM student_sections WHERE sectionId = :section
+    OR sectionName = :section COLLATE NOCASE)"""
+
+
+def connect(path):
+    """open (and if needed create) the store"""
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute('PRAGMA journal_mode=WAL')  # readers are not blocked by a load
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(schema)
+    return conn
+
+
+def course_records(json_response, loaded_at=None):
+    """the rows of every store table for one decoded CourseDetail response"""
+    course = json_response['data']['course']
+    course_id = course['courseId']
+    records = {table: [] for table in course_tables}
+    records['courses'].append((course_id, course.get('name'), course.get('contextId'), course.get('etlStart'),
+                               course.get('updatedAt'), loaded_at))
+    for edge in course['studentInCourseConnection']['edges']:
+        student, info = edge['student'], edge['student'].get('studentInfo') or {}
+        records['students'].append((
+            course_id, student['id'], student.get('studentId'), info.get('name'), info.get('sortableName'),
+            info.get('email'), info.get('sisId'), edge.get('currentOverallScore'), info.get('onTimePercentage'),
+            reformat('lastParticipationTime', edge.get('lastParticipationTime')),
+            reformat('lastPageviewTime', edge.get('lastPageviewTime'))))
+        for section in edge.get('sections') or []:
+            records['student_sections'].append((course_id, student['id'], section.get('id'), section.get('name')))
+    for edge in course['assignmentForCourseConnection']['edges']:
+        assignment = edge['assignment']
+        records['assignments'].append((
+            course_id, assignment['id'], assignment.get('name'), reformat('dueDate', assignment.get('dueDate')),
+            assignment.get('maxScoreRaw'), assignment.get('gradingType'), assignment.get('assignmentType')))
+    for row in course['assignmentsForStudents']:
+        records['activity'].append((
+            course_id, row['assignmentId'], row['studentId'], row.get('assignmentName'),
+            reformat('dueDate', row.get('dueDate')), row.get('excused'), row.get('late'), row.get('missing')))
+        for position, submission in enumerate(row.get('submissions') or []):
+            records['submissions'].append((
+                course_id, row['assignmentId'], row['studentId'], position, reformat('.date', submission.get('date')),
+                submission.get('gradeRaw'), submission.get('scoreRaw'), submission.get('percentage')))
+    return records
+
+
+def load_course(path, body, loaded_at):
+    """replace a course's rows in the store with those of a CourseDetail response
+        Args:
+            path: The store's SQLite file.
+            body: The raw CourseDetail response body.
+            loaded_at: The time of the load (epoch seconds).
+        Returns:
+            The number of rows loaded.
+    """
+    records = course_records(json.loads(body), loaded_at)
+    course_id = records['courses'][0][0]
+    conn = connect(path)
+    try:
+        with conn:  # one transaction, so readers see the old or the new course
+            for table in course_tables:
+                conn.execute('DELETE FROM %s WHERE courseId = ?' % table, (course_id,))
+                if records[table]:
+                    conn.executemany('INSERT INTO %s VALUES (%s)' % (table, ', '.join('?' * len(records[table][0]))),
+                                     records[table])
+    finally:
+        conn.close()
+    return sum(len(rows) for rows in records.values())
+
+
+def find_activity(path, course=None, student=None, assignment=None, section=None):
+    """look up activity rows in the store
+        Args:
+            path: The store's SQLite file.
+            course: Only this courseId.
+            student: A student's Canvas ID, student ID, SIS ID, email or (sortable) name.
+            assignment: An assignment's ID or name.
+            section: A section's ID or name.
+        Returns:
+            A tuple of the column names and the rows.
+    """
+    filters = [condition for value, condition in ((course, 'a.courseId = :course'), (student, student_filter),
+                                                  (assignment, assignment_filter), (section, section_filter))
+               if value is not None]
+    sql = activity_query + (' WHERE ' + ' AND '.join(filters) if filters else '') + \
+        ' ORDER BY a.courseId, a.dueDate, a.assignmentName, s.sortableName'
+    conn = connect(path)
+    try:
+        cursor = conn.execute(sql, {'course': course, 'student': student, 'assignment': assignment,
+                                    'section': section})
+        return [column[0] for column in cursor.description], cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def run_sql(path, sql):
+    """run a read-only SQL query against the store
+        Returns:
+            A tuple of the column names and the rows.
+    """
+    conn = sqlite3.connect('file:%s?mode=ro' % path, uri=True)
+    try:
+        cursor = conn.execute(sql)
+        return [column[0] for column in cursor.description or []], cursor.fetchall()
+    finally:
+        conn.close()
@@ -0,0 +1,26 @@
+"""summaries of courses without activity rows"""
+
+import os
+import sys
+import json
+
+import pytest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+sys.path.insert(0, os.path.join(here, '..', 'benchmarks'))
+from scraper import write_course  # noqa: E402
+from analytics import summary_labels, summary_columns  # noqa: E402
+from synthetic import synthetic_course  # noqa: E402
+
+
+@pytest.mark.parametrize('compact', [False, True])
+@pytest.mark.parametrize('normalize', [False, True])
+@pytest.mark.parametrize('students, assignments', [(0, 0), (5, 0), (0, 4)])
+def test_empty_activity_writes_empty_summaries(tmp_path, students, assignments, normalize, compact):
+    body = json.dumps(synthetic_course(students, assignments, 2)).encode()
+    write_course(body, str(tmp_path), normalize=normalize, compact=compact, summaries=True)
+    assert (tmp_path / 'students.csv').exists() and (tmp_path / 'assignments.csv').exists()
+    for table, labels in summary_labels.items():
+        with open(tmp_path / (table + '.csv')) as f:
+            assert f.read().strip().split(',')[1:] == labels + summary_columns
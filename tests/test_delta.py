@@ -0,0 +1,58 @@
+"""incremental (delta) scraping: a change to one row gives a one-row delta"""
+
+import os
+import sys
+import copy
+import json
+
+import pandas as pd
+import pytest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+sys.path.insert(0, os.path.join(here, '..', 'benchmarks'))
+from scraper import write_course  # noqa: E402
+from synthetic import synthetic_course  # noqa: E402
+
+
+def snapshots(change):
+    """a synthetic course and a later snapshot of it with one change"""
+    old = synthetic_course(20, 5, 2)
+    new = copy.deepcopy(old)
+    course = new['data']['course']
+    course['etlStart'] += 1
+    change(course)
+    return json.dumps(old).encode(), json.dumps(new).encode()
+
+
+def delta_rows(tmp_path, change, table, compact):
+    old, new = snapshots(change)
+    write_course(old, str(tmp_path), incremental=True, compact=compact)
+    write_course(new, str(tmp_path), incremental=True, compact=compact)
+    etl_start = json.loads(new)['data']['course']['etlStart']
+    return pd.read_csv(tmp_path / ('%s_delta_%s.csv' % (table, etl_start)), index_col=0)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_second_section_changes_one_student(tmp_path, compact):
+    def change(course):
+        edge = course['studentInCourseConnection']['edges'][3]
+        section = course['sections'][1]
+        edge['sections'].append({'id': section['id'], 'name': section['name'], '__typename': 'SectionEnrollment'})
+    delta = delta_rows(tmp_path, change, 'students', compact)
+    assert delta['change'].tolist() == ['changed']
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_second_submission_changes_one_activity_row(tmp_path, compact):
+    def change(course):
+        row = next(row for row in course['assignmentsForStudents'] if row['submissions'])
+        row['submissions'].append(dict(row['submissions'][0], gradeRaw='9', scoreRaw=9))
+    delta = delta_rows(tmp_path, change, 'student_assignment_activity', compact)
+    assert delta['change'].tolist() == ['changed']
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_unchanged_rows_give_an_empty_delta(tmp_path, compact):
+    delta = delta_rows(tmp_path, lambda course: None, 'student_assignment_activity', compact)
+    assert delta.empty
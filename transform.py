@@ -0,0 +1,471 @@
+#!/usr/bin/python3
+
+"""
+DESCRIPTION: Flattens the New Analytics CourseDetail GraphQL response into tables.
+INPUT(S):
+    - A decoded CourseDetail JSON response (see the notes at the bottom of scraper.py)
+"""
+
+import os
+import re
+import csv
+import json
+import time
+import pickle
+import tempfile
+# numpy and pandas are imported by the functions that use them, so the module imports quickly
+
+# change datetime fields to Y-m-d H:M:S
+datetime_headers = ['lastParticipationTime', 'lastPageviewTime', 'lastLoggedOut', 'dueDate', '.date']
+datetime_pattern = re.compile(r'|'.join(datetime_headers))
+# keys dropped from every table
+exclude = ['__typename', 'avatarURL', 'cursor']
+# keys dropped when they hold a list (the assignment stats' lists of missing
+# students) but kept as a scalar (the activity's missing flag)
+exclude_lists = ['missing']
+# typed schema: column name patterns for IDs and boolean flags
+id_pattern = re.compile(r'(^|\.)(id|(?!sisId)\w*Id)$')  # SIS IDs may have leading zeros
+flag_pattern = re.compile(r'(^|\.)(late|missing|excused|hasStudents)$')
+# normalized mode: the lists split out of each table into child tables, as
+# (table, list path) -> (child table, {child key column: parent column})
+child_tables = {
+    ('students', 'sections'): ('student_sections', {'studentId': 'student.id'}),
+    ('assignments', 'assignment.sectionStats'): ('assignment_section_stats', {'assignmentId': 'assignment.id'}),
+    ('assignments', 'assignment.sectionOverrides'): ('assignment_section_overrides', {'assignmentId': 'assignment.id'}),
+    ('student_assignment_activity', 'submissions'): ('submissions', {'assignmentId': 'assignmentId', 'studentId': 'studentId'}),
+}
+# compact mode: a string column becomes a categorical when it has at most this many
+# distinct values per row (assignment names, section names, grading types, ...)
+category_ratio = 0.5
+# output formats; plain csv keeps the original untyped layout
+output_formats = ['csv', 'csv.gz', 'csv.zst', 'parquet', 'feather']
+# where the rows of each table sit in the CourseDetail response
+table_paths = {
+    'students': 'data.course.studentInCourseConnection.edges.item',
+    'assignments': 'data.course.assignmentForCourseConnection.edges.item',
+    'student_assignment_activity': 'data.course.assignmentsForStudents.item',
+}
+
+
+def reformat(name, x):
+    """apply any special value re-formatting"""
+
+    # change datetime fields to Y-m-d H:M:S
+    if datetime_pattern.search(name) and isinstance(x, int):
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(x/1000.0))
+
+    return x
+
+
+def format_timestamps(ms):
+    """format a column of epoch milliseconds as Y-m-d H:M:S (UTC) in one NumPy pass
+        Matches time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(x/1000.0)) for each x.
+    """
+    import numpy as np
+    seconds = np.floor_divide(np.asarray(ms, dtype=np.int64), 1000).astype('datetime64[s]')
+    return np.char.replace(np.datetime_as_string(seconds, unit='s'), 'T', ' ').tolist()
+
+
+class Flattener:
+    """Flatten rows of nested json that share a schema into single-level dicts.
+        The flattened key of every path, and whether it is a datetime column, is
+        worked out the first time the path is seen and kept in a tree of nodes
+        ([key, is_datetime, children]), so rows are walked without building key
+        strings or running regexes. Datetime columns are converted in bulk once
+        all rows have been walked. With compact=True every distinct string
+        value is kept once, so repeated values (assignment and section names)
+        share one object instead of one per row.
+        #
+        # the original (recursive) version of this flattener is from
+        # https://stackoverflow.com/questions/52795561/flattening-nested-json-in-pandas-data-frame
+        #
+    """
+
+    def __init__(self, exclude=(), exclude_lists=(), prefix='', compact=False):
+        self.exclude = frozenset(exclude)
+        self.exclude_lists = frozenset(exclude_lists)
+        self.prefix = prefix  # where the rows sit in a larger row, for datetime detection
+        self.strings = {} if compact else None  # value -> the one copy kept
+        self.root = ['', False, {}]
+
+    def child(self, node, key):
+        """get (or compile) the node for a dict key or list index below node"""
+        name = str(key) if node is self.root else node[0] + '.' + str(key)
+        child = node[2][key] = [name, bool(datetime_pattern.search(self.prefix + name)), {}]
+        return child
+
+    def flatten_rows(self, rows):
+        """flatten an iterable of nested json objects
+            Args:
+                rows: Nested json objects.
+            Returns:
+                A list of flattened dicts, with keys in the same order as a
+                depth-first walk of each object.
+        """
+        exclude = self.exclude
+        exclude_lists = self.exclude_lists
+        strings = self.strings
+        out = []
+        timestamps = {}  # datetime column -> ([flattened dicts], [epoch ms])
+        for row in rows:
+            flat = {}
+            stack = [(row, self.root)]
+            while stack:
+                x, node = stack.pop()
+                t = type(x)
+                if t is dict or t is list:
+                    children = node[2]
+                    pushed = []
+                    for key, value in (x.items() if t is dict else enumerate(x)):
+                        if t is dict and (key in exclude or (key in exclude_lists and type(value) is list)):
+                            continue
+                        child = children.get(key)
+                        if child is None:
+                            child = self.child(node, key)
+                        pushed.append((value, child))
+                    stack.extend(reversed(pushed))  # keep depth-first key order
+                else:
+                    if t is str and strings is not None:
+                        x = strings.setdefault(x, x)
+                    flat[node[0]] = x
+                    if node[1] and isinstance(x, int):
+                        column = timestamps.get(node[0])
+                        if column is None:
+                            column = timestamps[node[0]] = ([], [])
+                        column[0].append(flat)
+                        column[1].append(x)
+            out.append(flat)
+
+        # convert each datetime column in one go
+        for name, (flats, ms) in timestamps.items():
+            try:
+                formatted = format_timestamps(ms)
+            except (OverflowError, ValueError):  # out of int64 range, do it the slow way
+                formatted = [reformat(name, x) for x in ms]
+            for flat, value in zip(flats, formatted):
+                flat[name] = value
+        return out
+
+
+def flatten_json(nested_json, exclude=['']):
+    """Flatten json object with nested keys into a single level.
+        Args:
+            nested_json: A nested json object.
+            exclude: Keys to exclude from output.
+        Returns:
+            The flattened json object.
+    """
+    return Flattener(exclude).flatten_rows([nested_json])[0]
+
+
+def course_rows(json_response, compact=False):
+    """flatten the students, assignments and student assignment activity rows
+        Args:
+            json_response: A decoded CourseDetail response.
+            compact: Keep one copy of each distinct string (see Flattener).
+        Returns:
+            A dict of table name to a list of flattened dicts.
+    """
+    course = json_response['data']['course']
+    return {
+        'students': Flattener(exclude, exclude_lists, compact=compact).flatten_rows(
+            course['studentInCourseConnection']['edges']),
+        'assignments': Flattener(exclude, exclude_lists, compact=compact).flatten_rows(
+            course['assignmentForCourseConnection']['edges']),
+        'student_assignment_activity': Flattener(exclude, exclude_lists, compact=compact).flatten_rows(
+            course['assignmentsForStudents']),
+    }
+
+
+def course_frames(json_response, compact=False):
+    """extract the students, assignments and student assignment activity tables
+        Args:
+            json_response: A decoded CourseDetail response.
+            compact: Build compact tables (see compact_frame).
+        Returns:
+            A dict of table name to DataFrame.
+    """
+    return rows_frames(course_rows(json_response, compact), compact)
+
+
+def rows_frames(rows, compact=False):
+    """build a DataFrame from each table of flattened rows (see course_rows), compact ones if asked"""
+    import pandas as pd
+    return {table: compact_frame(pd.DataFrame(table_rows)) if compact else pd.DataFrame(table_rows)
+            for table, table_rows in rows.items()}
+
+
+def split_lists(row, paths):
+    """split the lists at the given dotted paths out of a nested json row
+        Args:
+            row: A nested json object; it is not modified.
+            paths: Dotted paths of the lists to split out.
+        Returns:
+            A tuple of a copy of row without those lists, and a dict of path to list.
+    """
+    row = dict(row)
+    lists = {}
+    for path in paths:
+        keys = path.split('.')
+        parent = row
+        for key in keys[:-1]:
+            if type(parent.get(key)) is not dict:
+                parent = None
+                break
+            parent[key] = parent = dict(parent[key])  # copy on the way down
+        if parent is not None and type(parent.get(keys[-1])) is list:
+            lists[path] = parent.pop(keys[-1])
+    return row, lists
+
+
+def get_path(row, path):
+    """get the value at a dotted path of a nested json object, or None"""
+    for key in path.split('.'):
+        if type(row) is not dict:
+            return None
+        row = row.get(key)
+    return row
+
+
+def normalized_frames(json_response, compact=False):
+    """extract normalized tables: one row per entity, with lists moved to child tables
+        Instead of positional columns such as sections.0.id or
+        submissions.0.scoreRaw, each list in child_tables becomes a long table
+        linked to its parent by ID, with a position column for the list order.
+        The course's sections become their own table. All tables are built
+        in one pass over the rows.
+        Args:
+            json_response: A decoded CourseDetail response.
+            compact: Build compact tables (see compact_frame).
+        Returns:
+            A dict of table name to DataFrame.
+    """
+    import pandas as pd
+    course = json_response['data']['course']
+    sources = {
+        'students': course['studentInCourseConnection']['edges'],
+        'assignments': course['assignmentForCourseConnection']['edges'],
+        'student_assignment_activity': course['assignmentsForStudents'],
+    }
+    frames = {'sections': pd.DataFrame(Flattener(exclude, exclude_lists, compact=compact).flatten_rows(
+        course.get('sections') or []))}
+    for table, rows in sources.items():
+        children = {path: child for (parent, path), child in child_tables.items() if parent == table}
+        bases = []
+        child_keys = {path: [] for path in children}
+        child_items = {path: [] for path in children}
+        for row in rows:
+            base, lists = split_lists(row, children)
+            bases.append(base)
+            for path, items in lists.items():
+                keys = {key: get_path(base, column) for key, column in children[path][1].items()}
+                for position, item in enumerate(items):
+                    child_keys[path].append(dict(keys, position=position))
+                    child_items[path].append(item)
+        # flatten each table in bulk
+        frames[table] = pd.DataFrame(Flattener(exclude, exclude_lists, compact=compact).flatten_rows(bases))
+        for path, (child, _) in children.items():
+            flats = Flattener(exclude, exclude_lists, path + '.0.', compact).flatten_rows(child_items[path])
+            frames[child] = pd.DataFrame([{**keys, **flat} for keys, flat in zip(child_keys[path], flats)])
+    if compact:
+        frames = {table: compact_frame(frame) for table, frame in frames.items()}
+    return frames
+
+
+def iter_course_items(fp):
+    """yield the rows of a CourseDetail response one at a time, without loading the whole document
+        Args:
+            fp: A binary file-like object holding the response.
+        Returns:
+            An iterator of (table name, nested json row) tuples.
+        NOTE: without the optional ijson package the response is parsed in one go.
+    """
+    try:
+        import ijson
+        from ijson.common import ObjectBuilder
+    except ImportError:  # no streaming parser; same rows, unbounded memory
+        course = json.load(fp)['data']['course']
+        for table, path in table_paths.items():
+            rows = course
+            for key in path.split('.')[2:-1]:
+                rows = rows[key]
+            for row in rows:
+                yield table, row
+        return
+
+    tables = {path: table for table, path in table_paths.items()}
+    table = builder = None
+    for prefix, event, value in ijson.parse(fp, use_float=True):
+        if builder is not None:
+            if prefix == path and event in ('end_map', 'end_array'):
+                builder.event(event, value)
+                yield table, builder.value
+                builder = None
+            else:
+                builder.event(event, value)
+        elif event in ('start_map', 'start_array') and prefix in tables:
+            path, table = prefix, tables[prefix]
+            builder = ObjectBuilder()
+            builder.event(event, value)
+        elif prefix == 'errors' and event == 'start_array':
+            raise ValueError('CourseDetail response holds errors instead of data')
+
+
+def course_field(fp, name):
+    """read one top-level course field (e.g., courseId) from the start of a CourseDetail response"""
+    try:
+        import ijson
+    except ImportError:
+        return json.load(fp)['data']['course'].get(name)
+    return next(ijson.items(fp, 'data.course.' + name, use_float=True), None)
+
+
+def write_course_csv_stream(fp, out_dir, chunk_size=5000):
+    """flatten a CourseDetail response straight into the three CSV files in bounded memory
+        Rows are flattened in chunks of chunk_size and spooled to a temporary
+        file while the union of their columns is collected; each CSV is then
+        written chunk by chunk, with the same columns (in order of first
+        appearance) and index as the DataFrame path. Values are written as
+        they appear in the response, so an integer column with gaps is not
+        widened to floats the way a DataFrame does.
+        Args:
+            fp: A binary file-like object holding the response.
+            out_dir: The output folder.
+            chunk_size: Rows flattened (and held in memory) at a time.
+        Returns:
+            A dict of table name to row count.
+    """
+    spools = {table: tempfile.TemporaryFile() for table in table_paths}
+    columns = {table: {} for table in table_paths}  # dicts as ordered sets
+    counts = dict.fromkeys(table_paths, 0)
+    flatteners = {table: Flattener(exclude, exclude_lists) for table in table_paths}
+    chunks = {table: [] for table in table_paths}
+
+    def spool(table):
+        rows = flatteners[table].flatten_rows(chunks[table])
+        for row in rows:
+            columns[table].update(dict.fromkeys(row))
+        pickle.dump(rows, spools[table], pickle.HIGHEST_PROTOCOL)
+        counts[table] += len(rows)
+        chunks[table] = []
+
+    try:
+        for table, row in iter_course_items(fp):
+            chunks[table].append(row)
+            if len(chunks[table]) >= chunk_size:
+                spool(table)
+        for table in table_paths:
+            if chunks[table]:
+                spool(table)
+
+        os.makedirs(out_dir, exist_ok=True)
+        for table, spooled in spools.items():
+            header = list(columns[table])
+            spooled.seek(0)
+            with open(os.path.join(out_dir, table + '.csv'), 'w', newline='') as f:
+                writer = csv.writer(f, lineterminator=os.linesep)  # as DataFrame.to_csv writes
+                writer.writerow([''] + header)
+                index = 0
+                while True:
+                    try:
+                        rows = pickle.load(spooled)
+                    except EOFError:
+                        break
+                    for row in rows:
+                        writer.writerow([index] + [row.get(name) for name in header])
+                        index += 1
+    finally:
+        for spooled in spools.values():
+            spooled.close()
+    return counts
+
+
+def typed_frame(frame):
+    """convert a flattened table to a stable typed schema
+        ID columns become int64 (nullable Int64 when some rows lack them),
+        datetime columns become datetime64 and late/missing/excused/hasStudents
+        flags become bool (nullable boolean when some rows lack them). A column
+        that does not fully convert is left as it is.
+        Args:
+            frame: A table from course_frames.
+        Returns:
+            A typed copy of the table.
+    """
+    import pandas as pd
+    frame = frame.copy()
+    for name in frame.columns:
+        column = frame[name]
+        present = column.notna()
+        if id_pattern.search(name):
+            # convert only the present values, so 17-digit IDs never pass through float64,
+            # and each distinct ID once (activity rows repeat every student and assignment ID)
+            codes, uniques = pd.factorize(column[present])
+            converted = pd.to_numeric(pd.Series(uniques, dtype=object), errors='coerce')
+            if converted.dtype.kind in 'iu':
+                converted = pd.Series(converted.to_numpy()[codes], index=column.index[present])
+                frame[name] = converted.astype('int64') if present.all() else \
+                    converted.astype('Int64').reindex(column.index)
+        elif datetime_pattern.search('.' + name):  # also a normalized table's bare date column
+            converted = pd.to_datetime(column, format='%Y-%m-%d %H:%M:%S', errors='coerce')
+            if converted.notna().equals(present):
+                frame[name] = converted
+        elif flag_pattern.search(name):
+            if column[present].map(type).eq(bool).all():
+                frame[name] = column.astype('bool' if present.all() else 'boolean')
+    return frame
+
+
+def compact_frame(frame):
+    """shrink a table in memory
+        The typed schema (see typed_frame: int64 IDs, datetime64 dates, bool
+        flags), plus categoricals for the string columns whose values repeat
+        (see category_ratio), e.g., assignmentName in the activity table.
+        Args:
+            frame: A table from course_frames or normalized_frames.
+        Returns:
+            A compact copy of the table.
+    """
+    import pandas as pd
+    frame = typed_frame(frame)
+    for name in frame.columns:
+        column = frame[name]
+        if not pd.api.types.is_string_dtype(column.dtype) or isinstance(column.dtype, pd.CategoricalDtype):
+            continue
+        present = column.dropna()
+        if len(present) and present.nunique() <= category_ratio * len(present) and \
+                (column.dtype != object or present.map(type).eq(str).all()):
+            frame[name] = column.astype('category')
+    return frame
+
+
+def frames_memory(frames):
+    """the memory taken by each table, in bytes (strings included)"""
+    return {table: int(frame.memory_usage(deep=True).sum()) for table, frame in frames.items()}
+
+
+def write_table(frame, out_dir, name, fmt='csv'):
+    """write a table in one of the output_formats
+        Args:
+            frame: The table.
+            out_dir: The output folder.
+            name: The table name, e.g., students.
+            fmt: One of output_formats. Plain csv is written exactly as the
+                DataFrame is; the other formats use the typed schema (see
+                typed_frame), and Parquet/Feather drop the row index.
+        Returns:
+            The path written.
+    """
+    path = os.path.join(out_dir, name + '.' + fmt)
+    if fmt == 'csv':
+        frame.to_csv(path)
+    elif fmt == 'csv.gz':
+        typed_frame(frame).to_csv(path, compression='gzip')
+    elif fmt == 'csv.zst':  # needs the zstandard package
+        typed_frame(frame).to_csv(path, compression='zstd')
+    elif fmt == 'parquet':  # needs pyarrow
+        typed_frame(frame).to_parquet(path, index=False)
+    elif fmt == 'feather':  # needs pyarrow
+        typed_frame(frame).reset_index(drop=True).to_feather(path)
+    else:
+        raise ValueError('unknown output format %s' % fmt)
+    return path
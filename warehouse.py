@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+
+"""
+DESCRIPTION: SQLite history warehouse of every scrape. Each CourseDetail response becomes a
+    snapshot, identified by (courseId, etlStart). The students, sections, assignments, activity
+    and submissions tables hold one version of each row with the range of snapshots it is valid
+    for (validFrom up to, but excluding, validTo; validTo is NULL while the row is current).
+    A row that does not change between snapshots is stored once, so a semester of daily snapshots
+    takes little more room than the first one. The row of a snapshot S is found with
+        validFrom <= S AND (validTo IS NULL OR validTo > S)
+INPUT(S):
+    - Raw (decoded) CourseDetail response bodies, loaded in etlStart order per course
+"""
+
+import json
+import sqlite3
+import hashlib
+
+import store
+
+# the columns that identify a row of each table (besides courseId)
+table_keys = {
+    'students': ['studentId'],
+    'student_sections': ['studentId', 'sectionId'],
+    'assignments': ['assignmentId'],
+    'activity': ['assignmentId', 'studentId'],
+    'submissions': ['assignmentId', 'studentId', 'position'],
+}
+
+
+def table_columns():
+    """the columns of the store's course tables (see store.schema)"""
+    conn = sqlite3.connect(':memory:')
+    try:
+        conn.executescript(store.schema)
+        return {table: [row[1] for row in conn.execute('PRAGMA table_info(%s)' % table)] for table in table_keys}
+    finally:
+        conn.close()
+
+
+def schema(columns):
+    """the warehouse tables and indexes"""
+    statements = ["""CREATE TABLE IF NOT EXISTS snapshots (
+        snapshotId INTEGER PRIMARY KEY, courseId TEXT, name TEXT, etlStart INTEGER, updatedAt INTEGER,
+        loadedAt REAL, UNIQUE (courseId, etlStart))"""]
+    for table, keys in table_keys.items():
+        statements += [
+            'CREATE TABLE IF NOT EXISTS %s (%s, rowHash INTEGER, validFrom INTEGER, validTo INTEGER)' % (
+                table, ', '.join(columns[table])),
+            # the versions of one row, and the current rows of a course
+            'CREATE INDEX IF NOT EXISTS %s_key ON %s (courseId, %s, validFrom)' % (table, table, ', '.join(keys)),
+            'CREATE INDEX IF NOT EXISTS %s_current ON %s (courseId, validTo)' % (table, table),
+        ]
+    return ';\n'.join(statements) + ';'
+
+
+def connect(path):
+    """open (and if needed create) the warehouse"""
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(schema(table_columns()))
+    return conn
+
+
+def row_hash(row):
+    """a stable 64-bit hash of a row's values"""
+    return int.from_bytes(hashlib.blake2b(repr(row).encode(), digest_size=8).digest(), 'big', signed=True)
+
+
+def load_snapshot(path, body, loaded_at):
+    """add a CourseDetail response to the warehouse as a new snapshot
+        Only the rows that were added or changed since the course's latest
+        snapshot are inserted; rows that changed or disappeared are closed.
+        Args:
+            path: The warehouse's SQLite file.
+            body: The raw CourseDetail response body.
+            loaded_at: The time of the load (epoch seconds).
+        Returns:
+            The number of rows inserted, or None if the snapshot was already loaded.
+        Raises:
+            ValueError: The snapshot is older than the course's latest one.
+    """
+    records = store.course_records(json.loads(body))
+    course_id, name, _, etl_start, updated_at, _ = records['courses'][0]
+    columns = table_columns()
+    conn = connect(path)
+    try:
+        with conn:  # one transaction per snapshot
+            if conn.execute('SELECT 1 FROM snapshots WHERE courseId = ? AND etlStart = ?',
+                            (course_id, etl_start)).fetchone():
+                return None
+            latest = conn.execute('SELECT max(etlStart) FROM snapshots WHERE courseId = ?', (course_id,)).fetchone()[0]
+            if latest is not None and etl_start is not None and etl_start < latest:
+                raise ValueError('snapshot %s of course %s is older than the latest one (%s); '
+                                 'load snapshots in etlStart order' % (etl_start, course_id, latest))
+            snapshot_id = conn.execute(
+                'INSERT INTO snapshots (courseId, name, etlStart, updatedAt, loadedAt) VALUES (?, ?, ?, ?, ?)',
+                (course_id, name, etl_start, updated_at, loaded_at)).lastrowid
+            inserted = 0
+            for table, keys in table_keys.items():
+                positions = [columns[table].index(key) for key in keys]
+                current = {tuple(row[1:-1]): (row[0], row[-1]) for row in conn.execute(
+                    'SELECT rowid, %s, rowHash FROM %s WHERE courseId = ? AND validTo IS NULL' % (
+                        ', '.join(keys), table), (course_id,))}
+                new_rows, closed = [], []
+                for row in records[table]:
+                    key = tuple(row[i] for i in positions)
+                    h = row_hash(row)
+                    old = current.pop(key, None)
+                    if old is None or old[1] != h:  # added or changed
+                        new_rows.append(row + (h, snapshot_id, None))
+                        if old is not None:
+                            closed.append((snapshot_id, old[0]))
+                closed += [(snapshot_id, rowid) for rowid, _ in current.values()]  # removed
+                conn.executemany('UPDATE %s SET validTo = ? WHERE rowid = ?' % table, closed)
+                conn.executemany('INSERT INTO %s VALUES (%s)' % (table, ', '.join('?' * (len(columns[table]) + 3))),
+                                 new_rows)
+                inserted += len(new_rows)
+            return inserted
+    finally:
+        conn.close()
@@ -0,0 +1,254 @@
+#!/usr/bin/python3
+
+"""
+DESCRIPTION: Watch mode: one long-running process that polls a set of courses on a schedule and
+    scrapes a course only when it changed. Each course is polled every INTERVAL seconds, with
+    random jitter so polls do not line up. A poll first sends a tiny query for the course's
+    updatedAt/etlStart watermark, over the cached analytics session. Only when the watermark moved
+    is CourseDetail fetched, archived, transformed and written. The browser is started only when
+    a course has no usable analytics session, and it reuses the cached cookies.
+    Run with: python scraper.py watch username password --courses courses.txt
+INPUT(S):
+    - Canvas credentials
+    - Course URLs, optionally each with its own poll interval in seconds ("URL [INTERVAL]")
+"""
+
+import os
+import io
+import sys
+import time
+import heapq
+import random
+import signal
+import logging
+import argparse
+
+import scraper
+from transform import output_formats, course_field
+from delta import course_watermark
+from raw_archive import save_payload
+import store
+import warehouse
+
+logger = logging.getLogger('scraper.watch')
+
+# the cheap change check: just the course's watermark
+watermark_query = ('query CourseWatermark($contextId: String!, $tcGuid: String!) '
+                   '{ course(contextId: $contextId, tcGuid: $tcGuid) { courseId updatedAt etlStart } }')
+
+
+#
+# scheduling
+#
+def next_poll(now, interval, jitter):
+    """when to poll next: interval seconds from now, give or take jitter (a fraction of the interval)"""
+    return now + interval * random.uniform(1 - jitter, 1 + jitter)
+
+
+def retry_delay(interval, failures):
+    """back off after failed polls: 1, 2, 4, ... minutes, never longer than the interval"""
+    return min(interval, 60 * 2 ** (failures - 1))
+
+
+#
+# polling
+#
+class Watcher:
+    """polls the courses and scrapes the ones whose watermark moved"""
+
+    def __init__(self, args):
+        self.args = args
+        self.cache = scraper.load_session_cache(args.session_cache) if not args.no_session_cache \
+            else {'cookies': [], 'courses': {}}
+        self.http = scraper.create_http_session(args.page_workers)
+        self.watermarks = {}  # course URL -> [updatedAt, etlStart] of the last scrape
+        self.full_polls = set()  # courses whose session refused the watermark query
+
+    def save_cache(self):
+        if not self.args.no_session_cache:
+            scraper.save_session_cache(self.args.session_cache, self.cache)
+
+    def check(self, course_url):
+        """the course's current watermark, or None if there is no usable analytics session"""
+        import requests
+        analytics_session = scraper.cached_analytics_session(self.cache, course_url, self.args.max_session_age)
+        if not analytics_session or course_url in self.full_polls:
+            return None
+        try:
+            course = scraper.graphql_query(self.http, analytics_session, 'CourseWatermark',
+                                           query=watermark_query)['data']['course']
+            return [course.get('updatedAt'), course.get('etlStart')]
+        except (scraper.GraphQLError, ValueError, requests.HTTPError) as e:
+            if not scraper.query_refused(e):  # 401/403: expired or revoked
+                logger.info('Cached analytics session for %s is stale (%s).' % (course_url, e))
+                self.cache.get('courses', {}).pop(course_url, None)
+                return None
+            # the session may still be good for CourseDetail; compare the full responses until it is renewed
+            logger.info('Watermark query for %s refused (%s), fetching CourseDetail on every poll.' % (course_url, e))
+            self.full_polls.add(course_url)
+        return None
+
+    def fetch(self, course_url):
+        """get the course's CourseDetail response: from the cached session if possible, else a browser"""
+        args = self.args
+        body = scraper.fetch_cached_course_detail(self.http, self.cache, course_url, args.max_session_age,
+                                                  None, args.page_size, args.page_workers)
+        if body is not None:
+            return body
+        self.cache.get('courses', {}).pop(course_url, None)
+        driver = scraper.create_driver(not args.no_block)
+        try:
+            body, analytics_session = scraper.capture_course_detail(
+                driver, course_url, args.username, args.password, scraper.fresh_cookies(self.cache),
+                args.replay or bool(args.page_size), None, args.page_size, args.page_workers)
+            self.cache['cookies'] = driver.get_cookies()
+        finally:
+            driver.quit()  # idle browsers are not kept between polls
+        analytics_session['saved_at'] = time.time()
+        self.cache.setdefault('courses', {})[course_url] = analytics_session
+        self.full_polls.discard(course_url)
+        self.save_cache()
+        return body
+
+    def scrape(self, course_url, body):
+        """archive, write and load a changed course"""
+        args = self.args
+        if not args.no_archive:
+            save_payload(body, args.archive_dir, course_url)
+        out_dir = args.out_dir or '.'
+        if args.per_course:
+            out_dir = os.path.join(out_dir, str(course_field(io.BytesIO(body), 'courseId')))
+        scraper.write_course(body, out_dir, fmt=args.format, incremental=args.incremental, normalize=args.normalize,
+                             course_url=course_url, summaries=args.summaries, compact=args.compact)
+        if args.store:
+            store.load_course(args.store, body, time.time())
+        if args.warehouse:
+            warehouse.load_snapshot(args.warehouse, body, time.time())
+
+    def poll(self, course_url):
+        """check a course and scrape it if it changed
+            Returns:
+                True if the course was scraped.
+        """
+        watermark = self.check(course_url)
+        if watermark is not None and watermark == self.watermarks.get(course_url):
+            logger.debug('%s unchanged (updatedAt=%s, etlStart=%s).' % (course_url, watermark[0], watermark[1]))
+            return False
+        body = self.fetch(course_url)
+        watermark = course_watermark(body)
+        if watermark == self.watermarks.get(course_url):  # fetched without a cheap check
+            logger.debug('%s unchanged (updatedAt=%s, etlStart=%s).' % (course_url, watermark[0], watermark[1]))
+            return False
+        logger.info('%s changed (updatedAt=%s, etlStart=%s), scraping...' % (course_url, watermark[0], watermark[1]))
+        self.scrape(course_url, body)
+        self.watermarks[course_url] = watermark
+        return True
+
+    def run(self, intervals, max_polls=None):
+        """poll the courses until interrupted
+            Args:
+                intervals: A dict of course URL to poll interval in seconds.
+                max_polls: Stop after this many polls (for testing); None to run forever.
+        """
+        args = self.args
+        now = time.time()
+        # spread the first polls over the first jitter fraction of each interval
+        schedule = [(now + interval * random.uniform(0, args.jitter), course_url)
+                    for course_url, interval in intervals.items()]
+        heapq.heapify(schedule)
+        failures = {}
+        polls = 0
+        while schedule and (max_polls is None or polls < max_polls):
+            due, course_url = heapq.heappop(schedule)
+            time.sleep(max(0, due - time.time()))
+            polls += 1
+            interval = intervals[course_url]
+            try:
+                self.poll(course_url)
+                failures.pop(course_url, None)
+                due = next_poll(time.time(), interval, args.jitter)
+            except Exception as e:  # ooops!
+                failures[course_url] = failures.get(course_url, 0) + 1
+                due = time.time() + retry_delay(interval, failures[course_url])
+                logger.error('Could not poll %s (%s), retrying in %.0f s.' % (course_url, e, due - time.time()))
+            heapq.heappush(schedule, (due, course_url))
+
+
+#
+# command
+#
+def build_watch_parser():
+    """the command line parser of the watch command"""
+    parser = argparse.ArgumentParser(prog='scraper.py watch',
+                                     description='poll courses on a schedule and scrape the ones that changed')
+    parser.add_argument('username', help='Username')
+    parser.add_argument('password', help='Password')
+    parser.add_argument('course_url', nargs='*', help='Course URL(s)')
+    parser.add_argument('--courses', help='file with one course URL per line, optionally followed by its own '
+                                          'poll interval in seconds')
+    parser.add_argument('--interval', type=float, default=15*60, help='seconds between polls of a course')
+    parser.add_argument('--jitter', type=float, default=0.1,
+                        help='random spread of the poll times, as a fraction of the interval')
+    parser.add_argument('--out-dir', default=None,
+                        help='output folder; with several courses each one is written to OUT_DIR/<courseId>/')
+    parser.add_argument('--format', default='csv', choices=output_formats, help='see scraper.py --help')
+    parser.add_argument('--normalize', action='store_true', help='see scraper.py --help')
+    parser.add_argument('--summaries', action='store_true', help='see scraper.py --help')
+    parser.add_argument('--incremental', action='store_true', help='see scraper.py --help')
+    parser.add_argument('--compact', action='store_true', help='see scraper.py --help')
+    parser.add_argument('--replay', action='store_true', help='see scraper.py --help')
+    parser.add_argument('--page-size', type=int, help='see scraper.py --help')
+    parser.add_argument('--page-workers', type=int, default=4, help='see scraper.py --help')
+    parser.add_argument('--session-cache', default='.scraper_session.json', help='see scraper.py --help')
+    parser.add_argument('--max-session-age', type=float, default=8*60*60, help='see scraper.py --help')
+    parser.add_argument('--no-session-cache', action='store_true', help='see scraper.py --help')
+    parser.add_argument('--no-block', action='store_true', help='see scraper.py --help')
+    parser.add_argument('--store', help='see scraper.py --help')
+    parser.add_argument('--warehouse', help='see scraper.py --help')
+    parser.add_argument('--archive-dir', default='raw', help='see scraper.py --help')
+    parser.add_argument('--no-archive', action='store_true', help='see scraper.py --help')
+    return parser
+
+
+def parse_watch_args(argv=None):
+    """parse and check the command line
+        Returns:
+            A tuple of the parsed arguments and a dict of course URL to poll interval.
+    """
+    parser = build_watch_parser()
+    args = parser.parse_args(argv)
+    intervals = {course_url: args.interval for course_url in args.course_url}
+    if args.courses:
+        with open(args.courses) as f:
+            for line in f:
+                if not line.strip() or line.startswith('#'):
+                    continue
+                fields = line.split()
+                try:
+                    intervals[fields[0]] = float(fields[1]) if len(fields) > 1 else args.interval
+                except ValueError:
+                    parser.error('bad poll interval in %s: %s' % (args.courses, line.strip()))
+    if not intervals:
+        parser.error('at least one course URL is required')
+    if any(interval <= 0 for interval in intervals.values()):
+        parser.error('poll intervals must be positive')
+    if not 0 <= args.jitter < 1:
+        parser.error('--jitter must be at least 0 and less than 1')
+    error = scraper.option_error(False, args.format, args.incremental, args.normalize, args.summaries, args.compact)
+    if error:
+        parser.error(error)
+    args.per_course = len(intervals) > 1
+    return args, intervals
+
+
+def watch(argv=None):
+    """poll the courses until interrupted"""
+    args, intervals = parse_watch_args(argv)
+    scraper.configure_logging()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # shut down cleanly under a service manager
+    logger.info('Watching %d courses...' % len(intervals))
+    try:
+        Watcher(args).run(intervals)
+    except KeyboardInterrupt:
+        pass
+    logger.info('Watch stopped.')